@@ -0,0 +1,332 @@
+# ann_index.py
+"""Approximate-nearest-neighbour index types for the FAISS store.
+
+Supported types:
+
+- ``flat``: exact brute-force L2 search (LangChain's default)
+- ``ivf_flat``: inverted file over k-means cells; ``nprobe`` cells are scanned per query
+- ``ivf_pq``: like ``ivf_flat`` but vectors are product-quantized (~16x smaller)
+- ``hnsw``: graph index; ``efSearch`` trades recall for latency
+
+IVF indexes are trained on a random sample of the stored vectors. Chunk
+order is preserved, so the docstore mapping of the LangChain store stays
+valid. ``ivf_pq`` needs ``2**pq_bits`` training vectors, so smaller
+corpora get shorter codes. HNSW does not support removing vectors, so
+re-ingesting a document into an HNSW index rebuilds the graph without the
+replaced vectors (see ``rebuild_without``).
+
+Usage:
+    python ann_index.py migrate --type ivf_flat [--index-path faiss_index] [--nlist N]
+    python ann_index.py report [--index-path faiss_index] [--queries 200] [--k 10]
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Type new indexes are converted to when ingest.py rebuilds the store
+INDEX_TYPE = os.environ.get("RAG_INDEX_TYPE", "flat")
+
+# Per-query defaults when the request does not override them (0 = leave the index's own value)
+DEFAULT_NPROBE = int(os.environ.get("RAG_NPROBE", "0"))
+DEFAULT_EF_SEARCH = int(os.environ.get("RAG_EF_SEARCH", "0"))
+
+# faiss recommends 30-256 training points per IVF cell
+_TRAIN_POINTS_PER_CELL = 64
+# Smallest PQ code size build_index falls back to for small corpora
+_MIN_PQ_BITS = 4
+
+
+def index_type(index):
+    """Name of the ``INDEX_TYPES`` entry that ``index`` corresponds to."""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    return "flat"
+
+
+def default_nlist(count):
+    return max(1, min(65536, int(4 * math.sqrt(count))))
+
+
+def build_index(kind, vectors, nlist=None, pq_m=None, pq_bits=8, hnsw_m=32, train_sample=None, seed=0):
+    """Build and fill an index of type ``kind`` from an ``(n, d)`` float32 array."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = max(40, hnsw_m * 2)
+    elif kind in ("ivf_flat", "ivf_pq"):
+        nlist = min(nlist or default_nlist(count), count)
+        sample_size = train_sample or max(nlist * _TRAIN_POINTS_PER_CELL, 2 ** pq_bits if kind == "ivf_pq" else 0)
+        sample = _sample(vectors, sample_size, seed)
+        nlist = min(nlist, len(sample))
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        else:
+            pq_m = pq_m or _default_pq_m(dim)
+            pq_bits = _fit_pq_bits(pq_bits, len(sample))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits)
+        logger.info(f"Training {kind} index with nlist={nlist} on {len(sample)} vectors.")
+        index.train(sample)
+    else:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {', '.join(INDEX_TYPES)}")
+    index.add(vectors)
+    return index
+
+
+def _fit_pq_bits(pq_bits, train_count):
+    """Largest code size up to ``pq_bits`` whose 2**bits centroids ``train_count`` vectors can train."""
+    if train_count < 2 ** _MIN_PQ_BITS:
+        raise ValueError(
+            f"ivf_pq needs at least {2 ** _MIN_PQ_BITS} training vectors, got {train_count}; "
+            f"use flat or ivf_flat for an index this small"
+        )
+    fitted = min(pq_bits, int(math.log2(train_count)))
+    if fitted < pq_bits:
+        logger.warning(f"Only {train_count} training vectors; using {fitted}-bit PQ codes instead of {pq_bits}.")
+    return fitted
+
+
+def rebuild_without(index, positions):
+    """An HNSW index equal to ``index`` minus the vectors at ``positions``, renumbered in order.
+
+    Only ``IndexHNSWFlat`` can be rebuilt exactly; other HNSW variants raise ValueError.
+    """
+    if type(faiss.downcast_index(index)) is not faiss.IndexHNSWFlat:
+        raise ValueError(
+            f"Cannot remove vectors from a {type(index).__name__} index; "
+            f"migrate it to another type (python ann_index.py migrate --type flat) first"
+        )
+    keep = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), np.asarray(positions, dtype=np.int64))
+    vectors = index.reconstruct_batch(keep) if len(keep) else np.empty((0, index.d), dtype=np.float32)
+    logger.info(f"Rebuilding HNSW index without {len(positions)} vectors ({len(keep)} kept).")
+    rebuilt = build_index("hnsw", vectors, hnsw_m=index.hnsw.nb_neighbors(1))
+    rebuilt.hnsw.efConstruction = index.hnsw.efConstruction
+    rebuilt.hnsw.efSearch = index.hnsw.efSearch
+    return rebuilt
+
+
+def _default_pq_m(dim):
+    # Largest sub-quantizer count <= dim / 8 that divides dim (48 for MiniLM's 384)
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _sample(vectors, size, seed):
+    if size >= len(vectors):
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[np.sort(rng.choice(len(vectors), size, replace=False))]
+
+
+def all_vectors(index, positions=None):
+    """Return the vectors at ``positions`` (default: all), in order; lossy for PQ indexes."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        if positions is None:
+            return index.reconstruct_n(0, index.ntotal)
+        return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    # IVF ids can have gaps after removals, which only a hashtable direct map allows
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    try:
+        if positions is None:
+            positions = np.arange(index.ntotal)
+        return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    finally:
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """Per-query faiss SearchParameters for ``index``, or None to use its defaults.
+
+    Passing parameters per call avoids mutating the shared index, so concurrent
+    requests can use different ``nprobe``/``efSearch`` values.
+    """
+    nprobe = nprobe or DEFAULT_NPROBE
+    ef_search = ef_search or DEFAULT_EF_SEARCH
+    kind = index_type(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF()
+        if nprobe:
+            params.nprobe = nprobe
+    elif kind == "hnsw":
+        params = faiss.SearchParametersHNSW()
+        if ef_search:
+            params.efSearch = ef_search
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def convert(vectorstore, kind, **build_kwargs):
+    """Replace the index of a LangChain FAISS store in place with one of type ``kind``.
+
+    Vectors keep their order. Gaps left in IVF positions by removals are
+    closed, and ``index_to_docstore_id`` is renumbered to match.
+    """
+    previous = index_type(vectorstore.index)
+    if previous == "ivf_pq":
+        logger.warning("Source index is product-quantized; converted vectors are approximations.")
+    id_map = vectorstore.index_to_docstore_id
+    positions = sorted(id_map)
+    vectorstore.index = build_index(kind, all_vectors(vectorstore.index, positions), **build_kwargs)
+    if positions != list(range(len(positions))):
+        if hasattr(id_map, "compact"):
+            id_map.compact()
+        else:
+            vectorstore.index_to_docstore_id = {i: id_map[p] for i, p in enumerate(positions)}
+    return vectorstore
+
+
+def migrate(index_path=None, kind="ivf_flat", **build_kwargs):
+    """Rebuild the index at ``index_path`` as ``kind`` and save it atomically."""
+    from embeding import INDEX_PATH, index_write_lock, load_vectorstore, save_vectorstore
+    from index_store import discard
+
+    index_path = index_path or INDEX_PATH
+    with index_write_lock(index_path):
+        vectorstore = load_vectorstore(None, index_path, writable=True)
+        if vectorstore is None:
+            raise FileNotFoundError(f"No FAISS index found in {index_path}")
+        previous = index_type(vectorstore.index)
+        started = time.perf_counter()
+        try:
+            convert(vectorstore, kind, **build_kwargs)
+            save_vectorstore(vectorstore, index_path)
+        except Exception:
+            # Remove the writable staging copy load_vectorstore made
+            discard(vectorstore)
+            raise
+    logger.info(
+        f"Migrated {index_path} from {previous} to {kind} "
+        f"({vectorstore.index.ntotal} vectors) in {time.perf_counter() - started:.1f}s."
+    )
+    return vectorstore
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000.0 if len(values) else 0.0
+
+
+def recall_report(index_path=None, queries=200, k=10, nprobes=(1, 4, 8, 16, 32, 64),
+                  ef_searches=(16, 32, 64, 128, 256), seed=0):
+    """Recall@k and latency of the stored index against exact search, per search setting.
+
+    Queries are stored vectors with a little noise added, so the report can
+    be produced offline without the embedding model. For PQ indexes the exact
+    baseline runs over the reconstructed vectors, so the figures show the loss
+    from probing only, not from quantization.
+    """
+    from embeding import INDEX_PATH, load_vectorstore
+
+    index_path = index_path or INDEX_PATH
+    vectorstore = load_vectorstore(None, index_path)
+    if vectorstore is None:
+        raise FileNotFoundError(f"No FAISS index found in {index_path}")
+    index = vectorstore.index
+    positions = np.array(sorted(vectorstore.index_to_docstore_id), dtype=np.int64)
+    vectors = all_vectors(index, positions)
+    k = min(k, index.ntotal)
+    rng = np.random.default_rng(seed)
+    query_vectors = _sample(vectors, queries, seed).copy()
+    query_vectors += rng.normal(0, 0.01, query_vectors.shape).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(query_vectors, k)
+    truth = positions[truth]
+
+    kind = index_type(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        settings = [{"nprobe": n} for n in nprobes]
+    elif kind == "hnsw":
+        settings = [{"ef_search": ef} for ef in ef_searches]
+    else:
+        settings = [{}]
+
+    rows = []
+    for setting in settings:
+        params = search_parameters(index, **setting)
+        latencies = []
+        hits = 0
+        for query, expected in zip(query_vectors, truth):
+            started = time.perf_counter()
+            _, found = index.search(query[None, :], k, params=params)
+            latencies.append(time.perf_counter() - started)
+            hits += len(set(found[0]) & set(expected))
+        rows.append({
+            **setting,
+            f"recall@{k}": hits / (len(truth) * k),
+            "latency_ms_p50": _percentile(latencies, 50),
+            "latency_ms_p95": _percentile(latencies, 95),
+        })
+
+    exact_latencies = []
+    for query in query_vectors:
+        started = time.perf_counter()
+        exact.search(query[None, :], k)
+        exact_latencies.append(time.perf_counter() - started)
+
+    return {
+        "index_path": index_path,
+        "index_type": kind,
+        "vectors": int(index.ntotal),
+        "queries": len(query_vectors),
+        "exact_latency_ms_p50": _percentile(exact_latencies, 50),
+        "exact_latency_ms_p95": _percentile(exact_latencies, 95),
+        "settings": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the FAISS index type.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="rebuild the index as another type")
+    migrate_parser.add_argument("--type", choices=INDEX_TYPES, required=True)
+    migrate_parser.add_argument("--index-path", default=None)
+    migrate_parser.add_argument("--nlist", type=int, default=None)
+    migrate_parser.add_argument("--pq-m", type=int, default=None)
+    migrate_parser.add_argument("--pq-bits", type=int, default=8)
+    migrate_parser.add_argument("--hnsw-m", type=int, default=32)
+    migrate_parser.add_argument("--train-sample", type=int, default=None)
+
+    report_parser = subparsers.add_parser("report", help="recall/latency against exact search")
+    report_parser.add_argument("--index-path", default=None)
+    report_parser.add_argument("--queries", type=int, default=200)
+    report_parser.add_argument("--k", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate(
+            args.index_path, args.type, nlist=args.nlist, pq_m=args.pq_m, pq_bits=args.pq_bits,
+            hnsw_m=args.hnsw_m, train_sample=args.train_sample
+        )
+    else:
+        print(json.dumps(recall_report(args.index_path, queries=args.queries, k=args.k), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# answer_cache.py
+
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity between two questions for an answer to be reused
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.environ.get("RAG_ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_ANSWER_CACHE_MAX_ENTRIES", "1024"))
+
+
+class _Entry:
+    __slots__ = ("scope", "vector", "question", "answer", "sources", "expires")
+
+    def __init__(self, scope, vector, question, answer, sources, expires):
+        self.scope = scope
+        self.vector = vector
+        self.question = question
+        self.answer = answer
+        self.sources = sources
+        self.expires = expires
+
+
+class SemanticAnswerCache:
+    """Answers to earlier questions, looked up by question-embedding similarity.
+
+    Entries belong to a scope, normally the index version plus the LLM
+    settings, so an answer is never reused after the documents or the model
+    configuration change. Entries expire after ``ttl`` seconds, and the
+    least recently used ones are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, question_vector, scope):
+        """Return ``{"question", "answer", "sources", "similarity"}`` for the closest match, or None."""
+        query = self._normalize(question_vector)
+        now = time.monotonic()
+        with self._lock:
+            for entry_id in [i for i, e in self._entries.items() if e.expires <= now]:
+                del self._entries[entry_id]
+            candidates = [(i, e) for i, e in self._entries.items() if e.scope == scope]
+            if candidates:
+                similarities = np.stack([e.vector for _, e in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return {
+                        "question": entry.question,
+                        "answer": entry.answer,
+                        "sources": entry.sources,
+                        "similarity": float(similarities[best]),
+                    }
+            self.misses += 1
+            return None
+
+    def put(self, question, question_vector, scope, answer, sources=None):
+        entry = _Entry(
+            scope, self._normalize(question_vector), question, answer,
+            sources or [], time.monotonic() + self.ttl
+        )
+        with self._lock:
+            self._entries[next(self._ids)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "threshold": self.threshold,
+            }
@@ -1,37 +1,88 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
-import os
-import shutil
 from pathlib import Path
-import tempfile
-from extract_text import extract_text_from_pdf
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from extract_text import extract_page_texts
 from embeding import (
-    split_text,
-    create_documents,
-    create_embeddings,
-    store_embeddings,
-    load_local_llm,
-    create_qa_chain
+    DEFAULT_COLLECTION,
+    collection_path,
+    create_page_documents,
+    build_vectorstore,
+    create_qa_chain,
+    build_answer_prompt,
+    acondense_question,
+    describe_sources
 )
-from langchain.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from registry import ResourceRegistry
+from document_cache import DocumentIndexCache
+from concurrency import extract_stage, index_stage, llm_stage, upload_stage
+from answer_cache import SemanticAnswerCache
+from conversation import ConversationStore
+from jobs import JobRunner, describe_job
+from uploads import UploadStore, too_large
+import metrics
+from retrieval import HYBRID_SEARCH, make_retriever
+from context import context_tokens
+from rerank import get_reranker
+from index_store import SQLiteDocstore, normalize_filter
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
+metrics.install_trace_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
-)
+# Models and vector store shared by all requests
+registry = ResourceRegistry()
+
+# Per-document indexes for /ask, keyed by the uploaded file's hash
+document_cache = DocumentIndexCache()
+
+# Answers to earlier /chat questions, reused for semantically equivalent ones
+answer_cache = SemanticAnswerCache()
+
+# Token-bounded chat history per /chat session
+conversations = ConversationStore()
+
+# Background ingestion of uploads, persisted so interrupted jobs resume
+ingest_jobs = JobRunner(registry)
+
+def start_services():
+    upload_store.open()
+    registry.start()
+    conversations.llm = registry.llm
+    ingest_jobs.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.registry = registry
+
+    def startup_done(future):
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            logger.error("Startup failed; the server will not become ready", exc_info=error)
+            app.state.startup_error = f"{type(error).__name__}: {error}"
+
+    # Load and warm up models off the event loop so /healthz answers meanwhile;
+    # other endpoints return 503 until this finishes
+    startup = asyncio.get_running_loop().run_in_executor(None, start_services)
+    startup.add_done_callback(startup_done)
+    yield
+    # A startup error has already been reported by startup_done
+    await asyncio.wait([startup])
+    ingest_jobs.stop(timeout=5)
 
 # Create the FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Set by lifespan when loading models or starting the job workers raised
+app.state.startup_error = None
 
 # Add CORS middleware
 app.add_middleware(
@@ -49,69 +100,262 @@ templates_dir.mkdir(exist_ok=True)
 # Mount templates directory
 templates = Jinja2Templates(directory="templates")
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+# Uploaded PDFs, stored once per distinct content; created on disk at startup
+upload_store = UploadStore()
+
+def _cache_lookups(cache):
+    if cache is None:
+        return None
+    return {("hit",): cache.hits, ("miss",): cache.misses}
+
+metrics.register_collector(
+    "rag_index_vectors", "Vectors in the served index shard of each collection.", "gauge",
+    registry.index_sizes, labels=("collection",)
+)
+metrics.register_collector(
+    "rag_embedding_cache_lookups_total", "Chunk embedding cache lookups.", "counter",
+    lambda: _cache_lookups(registry.embeddings.cache if registry.embeddings else None), labels=("result",)
+)
+metrics.register_collector(
+    "rag_answer_cache_lookups_total", "Semantic answer cache lookups.", "counter",
+    lambda: _cache_lookups(answer_cache), labels=("result",)
+)
+metrics.register_collector(
+    "rag_document_cache_lookups_total", "Per-document /ask index cache lookups.", "counter",
+    lambda: _cache_lookups(document_cache), labels=("result",)
+)
+metrics.register_collector(
+    "rag_ingest_jobs", "Ingestion jobs by status.", "gauge",
+    lambda: {(status,): count for status, count in ingest_jobs.stats().items()}, labels=("status",)
+)
+metrics.register_collector(
+    "rag_stage_in_flight", "Requests holding a slot of each concurrency stage.", "gauge",
+    lambda: {(stage.name,): stage.active for stage in (upload_stage, extract_stage, index_stage, llm_stage)},
+    labels=("stage",)
+)
+
+# Endpoints that receive a PDF in the request body
+UPLOAD_PATHS = ("/upload", "/ask", "/ask/stream")
+
+# Endpoints answered while models are still loading
+PROBE_PATHS = ("/healthz", "/readyz", "/metrics")
+# Seconds clients are asked to wait before retrying during startup
+STARTUP_RETRY_AFTER = "5"
+
+@app.middleware("http")
+async def wait_until_started(request: Request, call_next):
+    """Answer 503 to everything but the probes until startup has finished."""
+    if registry.started.is_set() or request.url.path in PROBE_PATHS:
+        return await call_next(request)
+    if request.app.state.startup_error:
+        return JSONResponse(status_code=503, content={"detail": "Server failed to start"})
+    return JSONResponse(status_code=503, content={"detail": "Server is starting"},
+                        headers={"Retry-After": STARTUP_RETRY_AFTER})
+
+@app.middleware("http")
+async def limit_uploads(request: Request, call_next):
+    """Reject oversized uploads before their body is read."""
+    if request.method != "POST" or request.url.path not in UPLOAD_PATHS:
+        return await call_next(request)
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > upload_store.max_bytes:
+        error = too_large(upload_store.max_bytes)
+        return JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+    return await call_next(request)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Tag the request with a trace id (``X-Request-ID`` if sent) and time it."""
+    token = metrics.trace_id.set(request.headers.get("x-request-id") or metrics.new_trace_id())
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = metrics.trace_id.get()
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.REQUESTS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            path=route.path if route is not None else "unmatched",
+            status=status
+        )
+        metrics.trace_id.reset(token)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+def prepare_documents(pdf_path, source):
+    """Extract, split and wrap a PDF into Documents (blocking; run on the extract stage)."""
+    # Extract text from the uploaded file, page by page
+    pages = extract_page_texts(pdf_path)
+    if not any(pages):
+        raise HTTPException(status_code=500, detail="Failed to extract text from the file")
+
+    # Split each page into chunks tagged with source and page number
+    documents = create_page_documents(pages, source=source)
+    if not documents:
+        raise HTTPException(status_code=500, detail="Failed to create document objects")
+    return documents
+
+def resolve_collection(collection):
+    """Validate a collection name from a request, defaulting to the shared collection."""
+    collection = collection or DEFAULT_COLLECTION
     try:
-        # Create a unique filename
-        file_path = UPLOAD_DIR / file.filename
+        collection_path(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return collection
+
+@app.post("/upload", status_code=202)
+async def upload_file(file: UploadFile = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    try:
+        collection = resolve_collection(collection)
         
-        # Save the file
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Extract text from the uploaded file
-        text = extract_text_from_pdf(str(file_path))
-        if not text:
-            raise HTTPException(status_code=500, detail="Failed to extract text from the file")
-
-        # Split text into chunks
-        chunks = split_text(text)
-        if not chunks:
-            raise HTTPException(status_code=500, detail="Failed to split text into chunks")
-
-        # Create documents
-        documents = create_documents(chunks, source=file.filename)
-        if not documents:
-            raise HTTPException(status_code=500, detail="Failed to create document objects")
-
-        # Create embeddings
-        embedding_model = create_embeddings(documents)
-        if not embedding_model:
-            raise HTTPException(status_code=500, detail="Failed to create embeddings")
-
-        # Store embeddings in FAISS
-        vectorstore = store_embeddings(documents, embedding_model)
-        if not vectorstore:
-            raise HTTPException(status_code=500, detail="Failed to store embeddings")
+        # Stream the file into content-addressed storage, hashing it on the way
+        digest, file_path, _ = await upload_store.save(file)
+
+        # Skip files already indexed or queued for this collection
+        previous = upload_store.lookup(digest, collection)
+        job = ingest_jobs.get(previous["job_id"]) if previous else None
+        if job is not None and job["status"] != "failed":
+            upload_store.duplicates += 1
+            logger.info(f"Skipping duplicate upload {file.filename} (same content as {previous['filename']}).")
+            return {
+                "job_id": job["id"],
+                "filename": file.filename,
+                "collection": collection,
+                "status": job["status"],
+                "duplicate": True,
+                "message": f"Identical file already uploaded as {previous['filename']}"
+            }
+
+        # Extraction, embedding and indexing run in the background; poll /jobs/{job_id}
+        job_id = ingest_jobs.submit(collection, file.filename, file_path)
+        upload_store.record(digest, collection, file.filename, job_id)
 
         return {
+            "job_id": job_id,
             "filename": file.filename,
-            "status": "success",
-            "message": "File uploaded and processed successfully"
+            "collection": collection,
+            "status": "queued",
+            "message": "File uploaded and queued for processing"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in upload endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         file.file.close()
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return describe_job(job)
+
+def indexed_sources(collection):
+    """Documents indexed in the collection, read from its docstore (blocking)."""
+    vectorstore, _, _ = registry.snapshot(collection)
+    if vectorstore is None or not isinstance(vectorstore.docstore, SQLiteDocstore):
+        return []
+    return [source for source, _ in vectorstore.docstore.sources()]
+
 @app.get("/documents")
-async def get_documents():
+async def get_documents(collection: str = DEFAULT_COLLECTION):
     try:
-        # Get list of files in uploads directory
-        files = [f.name for f in UPLOAD_DIR.iterdir() if f.is_file()]
-        return files
+        # The snapshot may reload a shard another worker committed; keep it off the event loop
+        return await asyncio.to_thread(indexed_sources, resolve_collection(collection))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/collections")
+async def get_collections():
+    return await asyncio.to_thread(registry.collections)
+
+@app.get("/stats/embeddings")
+async def embedding_stats():
+    return registry.embedding_stats()
+
+@app.get("/stats/answers")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+@app.get("/stats/conversations")
+async def conversation_stats():
+    return await asyncio.to_thread(conversations.stats)
+
+@app.get("/stats/retrieval")
+async def retrieval_stats():
+    reranker = get_reranker()
+    return {"hybrid": HYBRID_SEARCH, "rerank": reranker.stats() if reranker else None}
+
+@app.get("/stats/jobs")
+async def job_stats():
+    return ingest_jobs.stats()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is serving HTTP and its startup has not failed."""
+    if app.state.startup_error:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": app.state.startup_error})
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: models are loaded and warmed up."""
+    status = {
+        "ready": registry.ready and not app.state.startup_error,
+        "started": registry.started.is_set(),
+        "embeddings": registry.embeddings is not None,
+        "llm": registry.llm is not None,
+        "startup_seconds": registry.startup_seconds,
+        "error": app.state.startup_error,
+    }
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/uploads")
+async def upload_stats():
+    return upload_store.stats()
+
+@app.get("/stats/stages")
+async def stage_stats():
+    return {stage.name: stage.stats() for stage in (upload_stage, extract_stage, index_stage, llm_stage)}
+
+async def ask_vectorstore(file: UploadFile):
+    """Return the per-document index for an /ask upload, building it on first sight."""
+    try:
+        # Hash the upload into a private temporary copy; shared blobs are left to /upload
+        async with upload_store.received(file) as (fingerprint, file_path):
+            # Reuse the index of a document we have already seen
+            vectorstore = await index_stage.run(document_cache.get, fingerprint, registry.embeddings)
+            if vectorstore is None:
+                documents = await extract_stage.run(prepare_documents, file_path, file.filename)
+
+                # Index this document on its own; the global index is left untouched
+                vectorstore = await index_stage.run(
+                    build_vectorstore, documents, registry.embeddings, doc_id=fingerprint[:16]
+                )
+                if not vectorstore:
+                    raise HTTPException(status_code=500, detail="Failed to store embeddings")
+                await index_stage.run(document_cache.put, fingerprint, vectorstore)
+            else:
+                logger.info(f"Reusing cached index for document {fingerprint[:16]}.")
+            return vectorstore
+    finally:
+        file.file.close()
+
 @app.post("/ask")
 async def ask_question(
     file: UploadFile = File(...),
@@ -123,36 +367,10 @@ async def ask_question(
         raise HTTPException(status_code=400, detail="No question provided")
     
     try:
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_path = temp_file.name
-        
-        # Extract text from PDF
-        text = extract_text_from_pdf(temp_path)
-        
-        # Split text into chunks
-        chunks = split_text(text)
-        if not chunks:
-            raise HTTPException(status_code=500, detail="Failed to process PDF text")
-        
-        # Create documents
-        documents = create_documents(chunks, source=file.filename)
-        if not documents:
-            raise HTTPException(status_code=500, detail="Failed to create documents")
-        
-        # Create embeddings
-        embedding_model = create_embeddings(documents)
-        if not embedding_model:
-            raise HTTPException(status_code=500, detail="Failed to create embeddings")
+        vectorstore = await ask_vectorstore(file)
         
-        # Store embeddings
-        vectorstore = store_embeddings(documents, embedding_model)
-        if not vectorstore:
-            raise HTTPException(status_code=500, detail="Failed to store embeddings")
-        
-        # Load LLM
-        llm = load_local_llm()
+        # Reuse the resident LLM
+        llm = registry.llm
         if not llm:
             raise HTTPException(status_code=500, detail="Failed to load language model")
         
@@ -163,22 +381,109 @@ async def ask_question(
         
         # Get answer
         chat_history = []
-        response = qa_chain({"question": question, "chat_history": chat_history})
+        async with llm_stage.slot():
+            response = await qa_chain.ainvoke({"question": question, "chat_history": chat_history})
         answer = response.get("answer", "Sorry, I couldn't find an answer to your question.")
         
-        # Clean up temporary file
-        os.unlink(temp_path)
-        
         return {"answer": answer}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # Clean up temporary file if it exists
-        if 'temp_path' in locals():
-            os.unlink(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_answer(request: Request, llm, retriever, question, on_complete=None,
+                        chat_history=None, session_id=None):
+    """Server-sent events: retrieved ``sources`` first, then ``token`` events, then ``done``.
+
+    The ``done`` event reports the ``context_tokens`` put into the prompt.
+
+    Generation stops as soon as the client disconnects; closing the token
+    stream closes the connection to Ollama, which abandons the request. The
+    caller must hold an llm stage slot, which is released here.
+    ``on_complete(answer, sources)`` is called on a worker thread once a full answer
+    has been sent.
+    With ``chat_history`` the question is first condensed into a standalone
+    one; ``session_id`` is announced in a leading ``session`` event.
+    """
+    token_stream = None
+    try:
+        if session_id is not None:
+            yield sse_event("session", {"session_id": session_id})
+        question = await acondense_question(llm, question, chat_history)
+        documents = await retriever.ainvoke(question)
+        sources = describe_sources(documents)
+        yield sse_event("sources", sources)
+
+        tokens = []
+        token_stream = llm.astream(build_answer_prompt(question, documents))
+        async for token in token_stream:
+            if await request.is_disconnected():
+                logger.info("Client disconnected; stopping generation.")
+                return
+            tokens.append(token)
+            yield sse_event("token", {"text": token})
+        yield sse_event("done", {"context_tokens": context_tokens(documents)})
+        if on_complete is not None:
+            await asyncio.to_thread(on_complete, "".join(tokens), sources)
+    except Exception as e:
+        logger.error(f"Error while streaming answer: {str(e)}")
+        yield sse_event("error", {"detail": str(e)})
     finally:
-        file.file.close()
+        if token_stream is not None:
+            await token_stream.aclose()
+        llm_stage.release()
+
+async def stream_cached_answer(cached, session_id):
+    yield sse_event("session", {"session_id": session_id})
+    yield sse_event("sources", cached["sources"])
+    yield sse_event("token", {"text": cached["answer"]})
+    yield sse_event("done", {"cached": True})
+
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/ask/stream")
+async def ask_question_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    question: str = Form(...)
+):
+    if not question:
+        raise HTTPException(status_code=400, detail="No question provided")
+    try:
+        vectorstore = await ask_vectorstore(file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not registry.llm:
+        raise HTTPException(status_code=500, detail="Failed to load language model")
+
+    await llm_stage.acquire()
+    return sse_response(stream_answer(request, registry.llm, make_retriever(vectorstore), question))
+
+def retrieval_options(message):
+    """Per-request retriever options from a chat body: ANN overrides and a metadata filter."""
+    try:
+        options = {key: int(message[key]) for key in ("nprobe", "ef_search") if message.get(key)}
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="nprobe and ef_search must be integers")
+    if message.get("filter"):
+        if not isinstance(message["filter"], dict):
+            raise HTTPException(status_code=400, detail="filter must be an object")
+        try:
+            options["filter"] = normalize_filter(message["filter"])
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return options
 
 @app.post("/chat")
 async def chat(message: dict):
@@ -188,41 +493,98 @@ async def chat(message: dict):
         if not user_message:
             raise HTTPException(status_code=400, detail="No message provided")
         
-        # Load the local LLM
-        llm = load_local_llm()
-        if not llm:
+        # Use the resident vector store and QA chain of the target collection; the snapshot
+        # may reload a shard another worker committed, so it runs off the event loop
+        collection = resolve_collection(message.get("collection"))
+        vectorstore, qa_chain, version = await asyncio.to_thread(registry.snapshot, collection)
+        if not registry.llm:
             raise HTTPException(status_code=500, detail="Failed to load language model")
-        
-        try:
-            # Load stored embeddings with allow_dangerous_deserialization
-            vectorstore = FAISS.load_local(
-                "faiss_index",
-                embeddings,
-                allow_dangerous_deserialization=True
-            )
-            if not vectorstore:
-                raise HTTPException(status_code=500, detail="No documents found. Please upload documents first.")
-        except Exception as e:
-            logger.error(f"Failed to load FAISS index: {str(e)}")
+        if vectorstore is None or qa_chain is None:
             raise HTTPException(status_code=500, detail="Failed to load document store. Please upload documents first.")
         
-        # Create QA chain
-        qa_chain = create_qa_chain(llm, vectorstore)
-        if not qa_chain:
-            raise HTTPException(status_code=500, detail="Failed to create QA chain")
+        # A per-request chain when the caller filters or tunes the search
+        options = retrieval_options(message)
+        if options:
+            qa_chain = create_qa_chain(registry.llm, vectorstore, make_retriever(vectorstore, **options))
+        
+        # Server-side history, bounded so the condensing prompt fits num_ctx
+        session_id = message.get("session_id") or conversations.new_session_id()
+        chat_history = await asyncio.to_thread(conversations.history, session_id)
+        
+        # Serve semantically equivalent standalone questions from the answer cache
+        scope = registry.answer_scope(version) + (json.dumps(options, sort_keys=True),)
+        question_vector = None
+        if not chat_history:
+            question_vector = await registry.embeddings.aembed_query(user_message)
+            cached = answer_cache.get(question_vector, scope)
+            if cached is not None:
+                await asyncio.to_thread(conversations.append, session_id, user_message, cached["answer"])
+                return {
+                    "answer": cached["answer"],
+                    "sources": cached["sources"],
+                    "session_id": session_id,
+                    "cached": True
+                }
         
         # Get answer using RAG
-        chat_history = []  # TODO: Implement chat history persistence
-        response = qa_chain({"question": user_message, "chat_history": chat_history})
+        async with llm_stage.slot():
+            response = await qa_chain.ainvoke({"question": user_message, "chat_history": chat_history})
+        source_documents = response.get("source_documents", [])
+        sources = describe_sources(source_documents)
+        used_tokens = context_tokens(source_documents)
+        if question_vector is not None:
+            answer_cache.put(user_message, question_vector, scope, response["answer"], sources)
+        await asyncio.to_thread(conversations.append, session_id, user_message, response["answer"])
         
         return {
             "answer": response["answer"],
-            "sources": response.get("sources", [])
+            "sources": sources,
+            "session_id": session_id,
+            "context_tokens": used_tokens
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(request: Request, message: dict):
+    user_message = message.get("message")
+    if not user_message:
+        raise HTTPException(status_code=400, detail="No message provided")
+    vectorstore, _, version = await asyncio.to_thread(
+        registry.snapshot, resolve_collection(message.get("collection"))
+    )
+    if not registry.llm:
+        raise HTTPException(status_code=500, detail="Failed to load language model")
+    if vectorstore is None:
+        raise HTTPException(status_code=500, detail="Failed to load document store. Please upload documents first.")
+
+    options = retrieval_options(message)
+    session_id = message.get("session_id") or conversations.new_session_id()
+    chat_history = await asyncio.to_thread(conversations.history, session_id)
+
+    scope = registry.answer_scope(version) + (json.dumps(options, sort_keys=True),)
+    question_vector = None
+    if not chat_history:
+        question_vector = await registry.embeddings.aembed_query(user_message)
+        cached = answer_cache.get(question_vector, scope)
+        if cached is not None:
+            await asyncio.to_thread(conversations.append, session_id, user_message, cached["answer"])
+            return sse_response(stream_cached_answer(cached, session_id))
+
+    def remember(answer, sources):
+        if question_vector is not None:
+            answer_cache.put(user_message, question_vector, scope, answer, sources)
+        conversations.append(session_id, user_message, answer)
+
+    await llm_stage.acquire()
+    return sse_response(stream_answer(
+        request, registry.llm, make_retriever(vectorstore, **options), user_message, on_complete=remember,
+        chat_history=chat_history, session_id=session_id
+    ))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
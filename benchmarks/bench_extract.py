@@ -0,0 +1,108 @@
+# benchmarks/bench_extract.py
+"""Compare PDF parse counts and wall time of extract_text_from_pdf_only
+against the per-page / per-table access pattern it replaced.
+
+Usage: python benchmarks/bench_extract.py path/to/file.pdf [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdfplumber  # noqa: E402
+import PyPDF2  # noqa: E402
+from pdfminer import high_level  # noqa: E402
+
+import extract_text  # noqa: E402
+
+
+class ParseCounter:
+    def __init__(self):
+        self.counts = {"pdfplumber.open": 0, "pdfminer.extract_pages": 0, "PyPDF2.PdfReader": 0}
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+@contextmanager
+def count_parses():
+    """Patch the parser entry points used by extract_text to count full-document parses."""
+    counter = ParseCounter()
+    originals = (pdfplumber.open, high_level.extract_pages, PyPDF2.PdfReader)
+
+    def counting_open(*args, **kwargs):
+        counter.counts["pdfplumber.open"] += 1
+        return originals[0](*args, **kwargs)
+
+    def counting_extract_pages(*args, **kwargs):
+        counter.counts["pdfminer.extract_pages"] += 1
+        return originals[1](*args, **kwargs)
+
+    def counting_reader(*args, **kwargs):
+        counter.counts["PyPDF2.PdfReader"] += 1
+        return originals[2](*args, **kwargs)
+
+    pdfplumber.open = counting_open
+    high_level.extract_pages = counting_extract_pages
+    PyPDF2.PdfReader = counting_reader
+    try:
+        yield counter
+    finally:
+        pdfplumber.open, high_level.extract_pages, PyPDF2.PdfReader = originals
+
+
+def legacy_parse_pattern(pdf_path):
+    """Replay the parser calls of the previous implementation.
+
+    One PyPDF2 reader, one pdfminer pass, one pdfplumber.open per page and
+    another pdfplumber.open plus extract_tables() per table. Text and OCR
+    work is skipped, so the timing is a lower bound for the old code.
+    """
+    with open(pdf_path, "rb") as f:
+        PyPDF2.PdfReader(f)
+        for pagenum, _ in enumerate(high_level.extract_pages(pdf_path)):
+            pdf = pdfplumber.open(pdf_path)
+            tables = pdf.pages[pagenum].find_tables()
+            for table_num in range(len(tables)):
+                table_pdf = pdfplumber.open(pdf_path)
+                table_pdf.pages[pagenum].extract_tables()[table_num]
+                table_pdf.close()
+            pdf.close()
+
+
+def run(fn, pdf_path, repeat):
+    timings = []
+    for _ in range(repeat):
+        with count_parses() as counter:
+            start = time.perf_counter()
+            fn(pdf_path)
+            timings.append(time.perf_counter() - start)
+    return {"parses": counter.counts, "total_parses": counter.total, "best_seconds": min(timings)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf_path")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy = run(legacy_parse_pattern, args.pdf_path, args.repeat)
+    single_pass = run(extract_text.extract_text_from_pdf_only, args.pdf_path, args.repeat)
+    report = {
+        "pdf": args.pdf_path,
+        "legacy_pattern": legacy,
+        "single_pass": single_pass,
+        "parse_reduction": legacy["total_parses"] / max(single_pass["total_parses"], 1),
+        "speedup": legacy["best_seconds"] / max(single_pass["best_seconds"], 1e-9),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/import_profile.py
+"""Report where the import time of a module goes.
+
+Imports the module in a fresh interpreter with ``python -X importtime``
+and lists the modules with the largest cumulative import time, plus
+whether any of the heavy dependencies that should only load on first use
+(torch, transformers, OCR and PDF libraries) came in with it.
+
+Usage: python benchmarks/import_profile.py [--module app] [--top 25] [--json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded by the paths that need them, never by importing app
+LAZY_MODULES = (
+    "torch", "transformers", "sentence_transformers", "langchain_huggingface", "langchain_ollama",
+    "fitz", "pdfplumber", "pdfminer", "pytesseract", "PIL",
+)
+
+
+def parse_importtime(stderr):
+    """``[(module, self_us, cumulative_us, depth)]`` from ``-X importtime`` output, in import order."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def profile_import(module="app"):
+    """Import ``module`` from the repository in a new interpreter and return the parsed timings.
+
+    Runs in a scratch directory because importing the app creates its
+    working directories.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (REPO_DIR, os.environ.get("PYTHONPATH")))))
+    with tempfile.TemporaryDirectory(prefix="rag-import-") as workdir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {module} failed:\n" + "\n".join(errors[-20:]))
+    return parse_importtime(result.stderr)
+
+
+def summarize(entries, module="app", top=25):
+    total = next((cumulative for name, _, cumulative, depth in entries if name == module and depth == 0), None)
+    loaded = {name.split(".")[0] for name, _, _, _ in entries}
+    by_cumulative = sorted(entries, key=lambda entry: entry[2], reverse=True)
+    by_self = sorted(entries, key=lambda entry: entry[1], reverse=True)
+    return {
+        "module": module,
+        "total_ms": round(total / 1000, 1) if total is not None else None,
+        "modules_imported": len(entries),
+        "heavy_modules_loaded": sorted(name for name in LAZY_MODULES if name in loaded),
+        "top_cumulative": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for name, self_us, cumulative, _ in by_cumulative[:top]
+        ],
+        "top_self": [
+            {"module": name, "self_ms": round(self_us / 1000, 1)}
+            for name, self_us, _, _ in by_self[:top]
+        ],
+    }
+
+
+def format_report(report):
+    lines = [
+        f"import {report['module']}: {report['total_ms']} ms, {report['modules_imported']} modules",
+        "heavy modules loaded: " + (", ".join(report["heavy_modules_loaded"]) or "none"),
+        "",
+        f"{'cumulative ms':>14} {'self ms':>9}  module",
+    ]
+    for entry in report["top_cumulative"]:
+        lines.append(f"{entry['cumulative_ms']:>14.1f} {entry['self_ms']:>9.1f}  {entry['module']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    report = summarize(profile_import(args.module), args.module, args.top)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    if report["heavy_modules_loaded"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
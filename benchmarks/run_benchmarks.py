@@ -0,0 +1,428 @@
+# benchmarks/run_benchmarks.py
+"""Offline benchmark suite for the ingestion and query paths.
+
+Generates synthetic PDFs (see synthetic_pdfs.py) and measures, on CPU and
+without network access:
+
+- ``extract``: ``extract_text_from_pdf`` and ``extract_text_from_pdf_only`` per PDF kind
+- ``split``: ``split_text`` over the extracted texts
+- ``embed``: ``embed_documents`` over all chunks
+- ``store``: ``store_embeddings`` of each document into a fresh index
+- ``retrieval``: retriever queries against the saved index
+- ``chat`` / ``chat_stream``: concurrent ``/chat`` and ``/chat/stream``
+  requests served in-process by the FastAPI app, answered by a local stub
+  Ollama server (stub_ollama.py)
+
+Each stage reports throughput, p50/p95/p99 latency and the peak RSS of the
+process so far, and the whole run is written as JSON. ``--baseline`` adds
+the ratio of every throughput and latency to an earlier run's. The run
+exits non-zero if any ``/chat`` or ``/chat/stream`` request did not
+return 200.
+
+Embeddings come from the configured sentence-transformers model when it is
+available offline, otherwise from ``HashEmbeddings`` (``--embeddings hash``
+forces it); the report records which one was used.
+
+Usage: python benchmarks/run_benchmarks.py [--pages 10] [--docs 2] [--kinds text tables figures]
+                                           [--queries 200] [--chat-requests 50] [--concurrency 4]
+                                           [--stages ...] [--output bench.json] [--baseline old.json]
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+from stub_ollama import StubSettings, start_stub_server  # noqa: E402
+from synthetic_pdfs import KINDS, generate_corpus, sample_questions  # noqa: E402
+
+STAGES = ("extract", "split", "embed", "store", "retrieval", "chat", "chat_stream")
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic feature-hashing embeddings of word unigrams and bigrams.
+
+    No model download and near-zero cost, so the other stages can be timed
+    on any machine; similar texts still get similar vectors.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        words = re.findall(r"\w+", text.lower())
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def latency_summary(seconds):
+    """Latency percentiles in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MB."""
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return {"self": round(own, 1), "children": round(children, 1)}
+
+
+def throughput(count, seconds):
+    return count / seconds if seconds > 0 else 0.0
+
+
+def bench_extract(corpus, report):
+    import extract_text
+
+    texts = {}
+    results = {}
+    for kind, paths in corpus.items():
+        pages = sum(extract_text.page_count(path) for path in paths)
+        for name in ("extract_text_from_pdf", "extract_text_from_pdf_only"):
+            fn = getattr(extract_text, name)
+            timings = []
+            for path in paths:
+                started = time.perf_counter()
+                text = fn(path)
+                timings.append(time.perf_counter() - started)
+                if name == "extract_text_from_pdf_only":
+                    texts[path] = text
+            results[f"{kind}/{name}"] = {
+                "documents": len(paths),
+                "pages": pages,
+                "pages_per_second": throughput(pages, sum(timings)),
+                "latency_per_document": latency_summary(timings),
+            }
+    report["extract"] = dict(results, peak_rss_mb=peak_rss_mb())
+    return texts
+
+
+def bench_split(texts, report):
+    from embeding import split_text
+
+    chunks = {}
+    timings = []
+    for path, text in texts.items():
+        started = time.perf_counter()
+        chunks[path] = split_text(text)
+        timings.append(time.perf_counter() - started)
+    total = sum(len(c) for c in chunks.values())
+    report["split"] = {
+        "documents": len(texts),
+        "chunks": total,
+        "chunks_per_second": throughput(total, sum(timings)),
+        "latency_per_document": latency_summary(timings),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return chunks
+
+
+def bench_embed(embeddings, chunks, report, batch_size):
+    texts = [chunk for document_chunks in chunks.values() for chunk in document_chunks]
+    vectors, timings = [], []
+    for start in range(0, len(texts), batch_size):
+        started = time.perf_counter()
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+        timings.append(time.perf_counter() - started)
+    report["embed"] = {
+        "vectors": len(vectors),
+        "batch_size": batch_size,
+        "vectors_per_second": throughput(len(vectors), sum(timings)),
+        "latency_per_batch": latency_summary(timings),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return vectors
+
+
+def bench_store(embeddings, chunks, vectors, index_path, report):
+    from langchain_core.documents import Document
+
+    from embeding import store_embeddings
+
+    timings = []
+    offset = 0
+    for path, document_chunks in chunks.items():
+        documents = [Document(page_content=chunk, metadata={"source": os.path.basename(path)})
+                     for chunk in document_chunks]
+        document_vectors = vectors[offset:offset + len(documents)]
+        offset += len(documents)
+        started = time.perf_counter()
+        if not store_embeddings(documents, embeddings, index_path=index_path, vectors=document_vectors):
+            raise RuntimeError(f"store_embeddings failed for {path}")
+        timings.append(time.perf_counter() - started)
+    index_bytes = sum(entry.stat().st_size for entry in os.scandir(index_path) if entry.is_file())
+    report["store"] = {
+        "documents": len(chunks),
+        "vectors": offset,
+        "vectors_per_second": throughput(offset, sum(timings)),
+        "latency_per_document": latency_summary(timings),
+        "index_bytes": index_bytes,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_retrieval(embeddings, index_path, questions, report):
+    from embeding import load_vectorstore
+    from retrieval import make_retriever
+
+    vectorstore = load_vectorstore(embeddings, index_path)
+    retriever = make_retriever(vectorstore)
+    timings = []
+    started_all = time.perf_counter()
+    for question in questions:
+        started = time.perf_counter()
+        retriever.invoke(question)
+        timings.append(time.perf_counter() - started)
+    elapsed = time.perf_counter() - started_all
+    report["retrieval"] = {
+        "queries": len(questions),
+        "queries_per_second": throughput(len(questions), elapsed),
+        "latency": latency_summary(timings),
+        "index_vectors": vectorstore.index.ntotal,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def _asgi_post(app, path, payload):
+    """POST ``payload`` to the ASGI ``app``; returns ``(status, seconds to first body byte, total seconds)``."""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json"),
+                                     (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    received = False
+    response = {"status": None, "first": None}
+    started = time.perf_counter()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body") and response["first"] is None:
+            response["first"] = time.perf_counter() - started
+
+    await app(scope, receive, send)
+    return response["status"], response["first"], time.perf_counter() - started
+
+
+async def _load_test(app, path, questions, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(question):
+        async with semaphore:
+            results.append(await _asgi_post(app, path, {"message": question}))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(question) for question in questions))
+    return results, time.perf_counter() - started
+
+
+def bench_chat(embeddings, index_path, questions, concurrency, stages, report):
+    import app as app_module
+    from embeding import llm_settings, load_local_llm
+
+    registry = app_module.registry
+    registry.index_path = index_path
+    registry.embeddings = embeddings
+    registry.llm = load_local_llm()
+    registry.llm_signature = llm_settings(registry.llm)
+    if registry.reload() is None:
+        raise RuntimeError(f"Could not load the index at {index_path}")
+    # The registry is filled in directly instead of by start(), so open the startup gate here
+    registry.started.set()
+
+    for stage, path in (("chat", "/chat"), ("chat_stream", "/chat/stream")):
+        if stage not in stages:
+            continue
+        # A distinct suffix per stage keeps the answer cache from serving the second run
+        results, elapsed = asyncio.run(
+            _load_test(app_module.app, path, [f"{question} ({stage})" for question in questions], concurrency)
+        )
+        ok = [result for result in results if result[0] == 200]
+        entry = {
+            "requests": len(results),
+            "errors": len(results) - len(ok),
+            "status_codes": dict(sorted(collections.Counter(str(status) for status, _, _ in results).items())),
+            "concurrency": concurrency,
+            "requests_per_second": throughput(len(ok), elapsed),
+            "latency": latency_summary([total for _, _, total in ok]),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        if stage == "chat_stream":
+            entry["time_to_first_event"] = latency_summary([first for _, first, _ in ok if first is not None])
+        report[stage] = entry
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Ratios of this run's throughputs and latency percentiles to ``baseline``'s (>1 = larger now)."""
+    ratios = {}
+
+    def walk(current, previous, prefix):
+        for key, value in current.items():
+            old = previous.get(key) if isinstance(previous, dict) else None
+            name = f"{prefix}.{key}" if prefix else key
+            if isinstance(value, dict):
+                walk(value, old, name)
+            elif (key.endswith("_per_second") or key in ("p50_ms", "p95_ms", "p99_ms")) \
+                    and isinstance(old, (int, float)) and old:
+                ratios[name] = round(value / old, 3)
+
+    walk(report["stages"], baseline.get("stages", {}), "")
+    return ratios
+
+
+def create_benchmark_embeddings(choice):
+    if choice in ("auto", "model"):
+        from embeding import create_embeddings
+
+        embeddings = create_embeddings()
+        if embeddings is not None:
+            return embeddings, "model"
+        if choice == "model":
+            raise SystemExit("The embedding model is not available offline; use --embeddings hash")
+    return HashEmbeddings(), "hash"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic PDF")
+    parser.add_argument("--docs", type=int, default=2, help="PDFs per kind")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--embeddings", choices=("auto", "model", "hash"), default="auto")
+    parser.add_argument("--embed-batch-size", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chat-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stub-tokens", type=int, default=64, help="tokens per stub Ollama answer")
+    parser.add_argument("--stub-token-ms", type=float, default=5.0)
+    parser.add_argument("--workdir", help="keep generated PDFs, caches and indexes here (default: a temp dir, removed)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    # Never reach out to the network for models
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    stub, stub_url = start_stub_server(settings=StubSettings(args.stub_tokens, args.stub_token_ms))
+    os.environ["RAG_OLLAMA_URL"] = stub_url
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    # Caches, uploads and indexes the app creates relative to the working directory stay in workdir
+    os.chdir(workdir)
+
+    stages = {}
+    started = time.perf_counter()
+    corpus = generate_corpus(os.path.join(workdir, "pdfs"), args.kinds, args.pages, args.docs, args.seed)
+    embeddings, embeddings_kind = create_benchmark_embeddings(args.embeddings)
+    index_path = os.path.join(workdir, "bench_index")
+    questions = sample_questions(max(args.queries, args.chat_requests), args.seed)
+
+    # Later stages need the outputs of earlier ones, which are always computed
+    texts = bench_extract(corpus, stages)
+    chunks = bench_split(texts, stages)
+    vectors = bench_embed(embeddings, chunks, stages, args.embed_batch_size)
+    bench_store(embeddings, chunks, vectors, index_path, stages)
+    if "retrieval" in args.stages:
+        bench_retrieval(embeddings, index_path, questions[:args.queries], stages)
+    if {"chat", "chat_stream"} & set(args.stages):
+        bench_chat(embeddings, index_path, questions[:args.chat_requests], args.concurrency, args.stages, stages)
+    stub.shutdown()
+    os.chdir(REPO_DIR)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "embeddings": embeddings_kind,
+            "workdir": args.workdir,
+            "wall_seconds": time.perf_counter() - started,
+        },
+        "config": vars(args),
+        "stages": {stage: stages[stage] for stage in STAGES if stage in stages and stage in args.stages},
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["vs_baseline"] = compare(report, json.load(f))
+
+    payload = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    print(payload)
+
+    failed = {stage: entry["status_codes"] for stage, entry in stages.items() if entry.get("errors")}
+    if failed:
+        # Latencies of failed requests are not comparable; a run with any is not a valid result
+        sys.exit(f"Requests failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# benchmarks/stub_ollama.py
+"""Minimal stand-in for the Ollama HTTP API, for offline load tests.
+
+Implements ``/api/generate`` and ``/api/chat`` (streamed NDJSON or a single
+JSON reply), ``/api/tags`` and ``/api/version``. Replies are canned words
+emitted with a fixed per-token delay after a "prefill" delay proportional
+to the prompt length, so answer latency and time to first token behave
+roughly like a small model on CPU without running one.
+
+Usage: python benchmarks/stub_ollama.py [--port 11435] [--tokens 64]
+                                        [--token-ms 5] [--prefill-ms-per-1k-chars 20]
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = "the pressure valve should be inspected every month according to the maintenance manual".split()
+
+
+class StubSettings:
+    def __init__(self, tokens=64, token_ms=5.0, prefill_ms_per_1k_chars=20.0):
+        self.tokens = tokens
+        self.token_ms = token_ms
+        self.prefill_ms_per_1k_chars = prefill_ms_per_1k_chars
+
+
+class _Handler(BaseHTTPRequestHandler):
+    settings = StubSettings()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "stub:latest", "model": "stub:latest", "size": 0}]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        else:
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path not in ("/api/generate", "/api/chat"):
+            self._send_json({"error": f"unsupported endpoint {self.path}"}, status=404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        chat = self.path == "/api/chat"
+        if chat:
+            prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+        else:
+            prompt = request.get("prompt", "")
+        settings = self.settings
+        started = time.perf_counter_ns()
+        time.sleep(len(prompt) / 1000 * settings.prefill_ms_per_1k_chars / 1000)
+        prompt_done = time.perf_counter_ns()
+        words = [_WORDS[i % len(_WORDS)] + " " for i in range(settings.tokens)]
+
+        def chunk(text, done):
+            payload = {"model": request.get("model", "stub"),
+                       "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+            if done:
+                now = time.perf_counter_ns()
+                payload.update({
+                    "done_reason": "stop",
+                    "total_duration": now - started,
+                    "prompt_eval_count": max(1, len(prompt) // 4),
+                    "prompt_eval_duration": prompt_done - started,
+                    "eval_count": len(words),
+                    "eval_duration": now - prompt_done,
+                })
+            return payload
+
+        if not request.get("stream", True):
+            time.sleep(settings.tokens * settings.token_ms / 1000)
+            self._send_json(chunk("".join(words), True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for word in words:
+                time.sleep(settings.token_ms / 1000)
+                self._write_chunk(chunk(word, False))
+            self._write_chunk(chunk("", True))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading, as the server does when a browser disconnects
+            pass
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(port=0, settings=None):
+    """Serve the stub on ``127.0.0.1:port`` in a daemon thread; returns ``(server, base_url)``."""
+    handler = type("StubHandler", (_Handler,), {"settings": settings or StubSettings()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-ollama", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    parser.add_argument("--prefill-ms-per-1k-chars", type=float, default=20.0)
+    args = parser.parse_args()
+    settings = StubSettings(args.tokens, args.token_ms, args.prefill_ms_per_1k_chars)
+    server, base_url = start_stub_server(args.port, settings)
+    print(f"Stub Ollama listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
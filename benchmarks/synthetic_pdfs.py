@@ -0,0 +1,145 @@
+# benchmarks/synthetic_pdfs.py
+"""Generate deterministic synthetic PDFs for the benchmarks.
+
+Three kinds exercise different extraction paths:
+
+- ``text``: pages of paragraphs
+- ``tables``: pages of ruled tables (found by pdfplumber's table finder)
+- ``figures``: pages with rendered images of text (sent to OCR)
+
+Usage: python benchmarks/synthetic_pdfs.py out_dir [--kinds text tables figures]
+                                           [--pages 20] [--docs 1] [--seed 0]
+"""
+
+import argparse
+import io
+import os
+import random
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+
+KINDS = ("text", "tables", "figures")
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+
+# Plain vocabulary plus identifier-like tokens, so keyword search has something to find
+_WORDS = (
+    "pump valve pressure sensor calibration maintenance inspection bearing motor "
+    "flow rate temperature threshold alarm shutdown procedure operator manual safety "
+    "seal gasket torque voltage current frequency interval schedule replacement filter "
+    "coolant lubricant vibration spindle housing coupling assembly tolerance nominal"
+).split()
+
+
+def _sentence(rng, words=12):
+    tokens = [rng.choice(_WORDS) for _ in range(words)]
+    if rng.random() < 0.3:
+        tokens.insert(rng.randrange(len(tokens)), f"PN-{rng.randrange(1000, 9999)}")
+    return " ".join(tokens).capitalize() + "."
+
+
+def _paragraph(rng, sentences=6):
+    return " ".join(_sentence(rng, rng.randint(8, 16)) for _ in range(sentences))
+
+
+def _text_page(page, rng):
+    rect = fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN)
+    text = "\n\n".join(_paragraph(rng) for _ in range(6))
+    page.insert_textbox(rect, text, fontsize=10, fontname="helv")
+
+
+def _table_page(page, rng, rows=18, cols=5):
+    header = ["Part", "Component", "Min", "Max", "Interval"]
+    cell_w = (PAGE_WIDTH - 2 * MARGIN) / cols
+    cell_h = 20
+    for table_top in (MARGIN, PAGE_HEIGHT / 2 + 10):
+        for r in range(rows + 1):
+            y = table_top + r * cell_h
+            page.draw_line((MARGIN, y), (PAGE_WIDTH - MARGIN, y), width=0.5)
+        for c in range(cols + 1):
+            x = MARGIN + c * cell_w
+            page.draw_line((x, table_top), (x, table_top + rows * cell_h), width=0.5)
+        for r in range(rows):
+            for c in range(cols):
+                if r == 0:
+                    value = header[c]
+                elif c == 0:
+                    value = f"PN-{rng.randrange(1000, 9999)}"
+                elif c == 1:
+                    value = rng.choice(_WORDS)
+                else:
+                    value = f"{rng.uniform(0, 500):.1f}"
+                page.insert_text(
+                    (MARGIN + c * cell_w + 3, table_top + r * cell_h + 14), value, fontsize=9, fontname="helv"
+                )
+
+
+def _figure_image(rng, width=900, height=360):
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(8):
+        draw.text((20, 20 + line * 40), _sentence(rng, 8), fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _figure_page(page, rng):
+    page.insert_textbox(
+        fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, MARGIN + 120), _paragraph(rng, 3), fontsize=10, fontname="helv"
+    )
+    for top in (MARGIN + 140, MARGIN + 460):
+        page.insert_image(fitz.Rect(MARGIN, top, PAGE_WIDTH - MARGIN, top + 280), stream=_figure_image(rng))
+
+
+_PAGE_WRITERS = {"text": _text_page, "tables": _table_page, "figures": _figure_page}
+
+
+def sample_questions(count, seed=0):
+    """Questions drawn from the same vocabulary as the documents."""
+    rng = random.Random(f"questions:{seed}")
+    return [f"What does the manual say about {_sentence(rng, 5).rstrip('.').lower()}?" for _ in range(count)]
+
+
+def generate_pdf(path, kind, pages, seed=0):
+    """Write a ``pages``-page PDF of ``kind`` to ``path``; the same seed gives the same file content."""
+    rng = random.Random(f"{kind}:{seed}")
+    doc = fitz.open()
+    try:
+        for _ in range(pages):
+            _PAGE_WRITERS[kind](doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT), rng)
+        doc.save(path, garbage=3, deflate=True)
+    finally:
+        doc.close()
+    return path
+
+
+def generate_corpus(out_dir, kinds=KINDS, pages=20, docs=1, seed=0):
+    """Generate ``docs`` PDFs of each kind; returns ``{kind: [paths]}``."""
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = {}
+    for kind in kinds:
+        corpus[kind] = [
+            generate_pdf(os.path.join(out_dir, f"{kind}-{i:03d}.pdf"), kind, pages, seed + i)
+            for i in range(docs)
+        ]
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--docs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for kind, paths in generate_corpus(args.out_dir, args.kinds, args.pages, args.docs, args.seed).items():
+        for path in paths:
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
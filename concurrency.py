@@ -0,0 +1,126 @@
+# concurrency.py
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, str(default)))
+
+
+class StageLimiter:
+    """Bounded concurrency for one pipeline stage.
+
+    At most ``max_concurrency`` requests run the stage at once and at most
+    ``max_waiting`` more may queue for a slot. Beyond that, requests are
+    rejected immediately with ``reject_status`` so that a burst of uploads
+    cannot pile up behind the event loop. Blocking callables passed to
+    ``run`` execute on the stage's own thread pool.
+    """
+
+    def __init__(self, name, max_concurrency, max_waiting, reject_status=503, retry_after=1):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.reject_status = reject_status
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"stage-{name}")
+
+    def _get_semaphore(self):
+        # Created lazily so it binds to the server's running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def acquire(self):
+        """Wait for a slot, or raise immediately if the stage's queue is full."""
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            logger.warning(f"Rejecting request: {self.name} stage is saturated.")
+            raise HTTPException(
+                status_code=self.reject_status,
+                detail=f"Server busy ({self.name}), please retry later",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._get_semaphore().release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking callable on this stage's thread pool once a slot is free."""
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            # Run in a copy of the caller's context so log lines keep its trace id
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_waiting": self.max_waiting,
+        }
+
+
+# PDF parsing and chunking; each extraction may itself fan out to RAG_EXTRACT_WORKERS processes
+extract_stage = StageLimiter(
+    "extract",
+    max_concurrency=_env_int("RAG_EXTRACT_CONCURRENCY", 2),
+    max_waiting=_env_int("RAG_EXTRACT_QUEUE", 8),
+    reject_status=429
+)
+
+# Embedding and FAISS index builds, loads and saves
+index_stage = StageLimiter(
+    "index",
+    max_concurrency=_env_int("RAG_INDEX_CONCURRENCY", 2),
+    max_waiting=_env_int("RAG_INDEX_QUEUE", 8),
+    reject_status=429
+)
+
+# Calls to the Ollama backend
+llm_stage = StageLimiter(
+    "llm",
+    max_concurrency=_env_int("RAG_LLM_CONCURRENCY", 4),
+    max_waiting=_env_int("RAG_LLM_QUEUE", 32),
+    reject_status=503
+)
+
+# Upload bodies being received; further uploads are turned away rather than queued
+upload_stage = StageLimiter(
+    "upload",
+    max_concurrency=_env_int("RAG_UPLOAD_CONCURRENCY", 4),
+    max_waiting=_env_int("RAG_UPLOAD_QUEUE", 0),
+    reject_status=429
+)
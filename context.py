@@ -0,0 +1,118 @@
+# context.py
+
+import logging
+import os
+import re
+
+from langchain_core.documents import Document
+
+from tokens import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens of retrieved context put into the answer prompt. With num_ctx=2048
+# this leaves room for the prompt template, the question and the answer.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "1024"))
+# Word-trigram Jaccard similarity above which two chunks count as duplicates
+DUPLICATE_SIMILARITY = float(os.environ.get("RAG_CONTEXT_DUPLICATE_SIMILARITY", "0.8"))
+
+# Shortest run of characters treated as the overlap between adjacent chunks
+_MIN_OVERLAP = 20
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _is_duplicate(shingles, kept):
+    for other in kept:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+def _adjacent(a, b):
+    """True if chunk ``b`` directly follows chunk ``a`` on the same page of the same document."""
+    meta_a, meta_b = a.metadata, b.metadata
+    if "chunk" not in meta_a or "chunk" not in meta_b:
+        return False
+    return (
+        meta_a.get("doc_id", meta_a.get("source")) == meta_b.get("doc_id", meta_b.get("source"))
+        and meta_a.get("page") == meta_b.get("page")
+        and meta_b["chunk"] == meta_a["chunk"] + 1
+    )
+
+
+def _join(a, b):
+    """Concatenate two consecutive chunks, dropping the splitter's overlap between them."""
+    for size in range(min(len(a), len(b)), _MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    return f"{a}\n{b}"
+
+
+def _merge_runs(documents):
+    """Group documents into runs of consecutive chunks, in the rank order of each run's best chunk."""
+    runs = []
+    for document in documents:
+        for run in runs:
+            if _adjacent(run[-1], document):
+                run.append(document)
+                break
+            if _adjacent(document, run[0]):
+                run.insert(0, document)
+                break
+        else:
+            runs.append([document])
+    merged = []
+    for run in runs:
+        text = run[0].page_content
+        for document in run[1:]:
+            text = _join(text, document.page_content)
+        metadata = dict(run[0].metadata)
+        if len(run) > 1:
+            metadata["chunks"] = [document.metadata["chunk"] for document in run]
+        merged.append(Document(page_content=text, metadata=metadata))
+    return merged
+
+
+def pack_context(documents, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Assemble retrieved ``documents`` (best first) into a prompt context of at most ``token_budget`` tokens.
+
+    Near-duplicate chunks are dropped, consecutive chunks from the same page
+    are merged without their overlap, and the results are packed greedily
+    in rank order. The best result is truncated rather than dropped if it
+    alone exceeds the budget. Each returned document records its token
+    estimate in ``metadata["tokens"]``.
+    """
+    unique, kept_shingles = [], []
+    for document in documents:
+        shingles = _shingles(document.page_content)
+        if _is_duplicate(shingles, kept_shingles):
+            continue
+        kept_shingles.append(shingles)
+        unique.append(document)
+
+    packed, used = [], 0
+    for document in _merge_runs(unique):
+        tokens = estimate_tokens(document.page_content)
+        if used + tokens > token_budget:
+            if packed:
+                continue
+            document.page_content = truncate_to_tokens(document.page_content, token_budget)
+            tokens = estimate_tokens(document.page_content)
+        document.metadata["tokens"] = tokens
+        packed.append(document)
+        used += tokens
+    logger.debug(
+        f"Packed {len(documents)} retrieved chunks into {len(packed)} passages, "
+        f"{used}/{token_budget} tokens."
+    )
+    return packed
+
+
+def context_tokens(documents):
+    """Token estimate of the context made of ``documents``."""
+    return sum(document.metadata.get("tokens", estimate_tokens(document.page_content)) for document in documents)
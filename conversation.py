@@ -0,0 +1,222 @@
+# conversation.py
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import SystemMessage
+
+from tokens import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens of chat history (turns plus summary) sent to the question-condensing
+# step; together with the question and prompt template it must fit num_ctx
+HISTORY_TOKEN_BUDGET = int(os.environ.get("RAG_HISTORY_TOKEN_BUDGET", "512"))
+# Fold turns that fall out of the budget into a rolling summary using the LLM
+HISTORY_SUMMARIZE = os.environ.get("RAG_HISTORY_SUMMARIZE", "0") == "1"
+SESSION_TTL = float(os.environ.get("RAG_SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.environ.get("RAG_MAX_SESSIONS", "1000"))
+# Shared by every server worker, so a follow-up may reach any of them
+CONVERSATIONS_DB = os.environ.get("RAG_CONVERSATIONS_DB", "conversations.sqlite")
+
+SUMMARY_PROMPT = """Progressively summarize the conversation below, adding onto the previous summary. Keep names, figures and document references. Answer with the new summary only, in at most {max_words} words.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+CREATE TABLE IF NOT EXISTS turns (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, seq);
+"""
+
+
+def format_chat_history(history):
+    """Render history the way ConversationalRetrievalChain does for its condense prompt."""
+    lines = []
+    for turn in history:
+        if isinstance(turn, SystemMessage):
+            lines.append(turn.content)
+        else:
+            human, ai = turn
+            lines.append(f"Human: {human}\nAssistant: {ai}")
+    return "\n".join(lines)
+
+
+class ConversationStore:
+    """Per-session chat history kept on the server, bounded by a token budget.
+
+    Only the most recent turns that fit in ``token_budget`` are kept. With
+    ``summarize`` enabled, older turns are folded by the LLM into a short
+    rolling summary in the background, and that summary takes part of the
+    budget. Either way the history sent with each question has a fixed upper
+    size, however long the conversation runs. Idle sessions expire after
+    ``ttl`` seconds; the least recently used are dropped beyond
+    ``max_sessions``.
+
+    Sessions live in a SQLite file (``RAG_CONVERSATIONS_DB``) opened on
+    first use, so every server worker sharing it sees the same history.
+    """
+
+    def __init__(self, path=CONVERSATIONS_DB, token_budget=HISTORY_TOKEN_BUDGET, summarize=HISTORY_SUMMARIZE,
+                 ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.path = path
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_budget = token_budget // 3
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.llm = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex
+
+    def _db(self):
+        # Callers hold _lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA foreign_keys = ON")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _transaction(self, fn, *args):
+        """Run ``fn(conn, *args)`` in one write transaction, so other workers see all of it or none."""
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def _expire(self, conn, now):
+        conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+
+    def history(self, session_id):
+        """Chat history for ``session_id`` in the format ConversationalRetrievalChain accepts."""
+        def read(conn):
+            now = time.time()
+            row = conn.execute(
+                "SELECT summary FROM sessions WHERE id = ? AND last_used >= ?", (session_id, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None, []
+            conn.execute("UPDATE sessions SET last_used = ? WHERE id = ?", (now, session_id))
+            turns = conn.execute(
+                "SELECT question, answer FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            return row[0], turns
+
+        summary, turns = self._transaction(read)
+        if summary is None:
+            return []
+        history = []
+        remaining = self.token_budget
+        if summary:
+            summary = f"Summary of the earlier conversation: {summary}"
+            history.append(SystemMessage(content=summary))
+            remaining -= estimate_tokens(summary)
+        # Newest turns first until the budget is spent
+        recent = []
+        for question, answer in reversed(turns):
+            remaining -= estimate_tokens(question) + estimate_tokens(answer)
+            if remaining < 0 and recent:
+                break
+            recent.append((question, answer))
+        history.extend(reversed(recent))
+        return history
+
+    def append(self, session_id, question, answer):
+        answer = truncate_to_tokens(answer, self.token_budget // 2)
+
+        def write(conn):
+            now = time.time()
+            self._expire(conn, now)
+            conn.execute(
+                "INSERT INTO sessions (id, last_used) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET last_used = excluded.last_used",
+                (session_id, now)
+            )
+            conn.execute(
+                "INSERT INTO turns (session_id, question, answer) VALUES (?, ?, ?)", (session_id, question, answer)
+            )
+            return self._enforce_budget(conn, session_id)
+
+        evicted = self._transaction(write)
+        if evicted and self.summarize and self.llm is not None:
+            self._summarizer.submit(self._fold_into_summary, session_id, evicted)
+
+    def _enforce_budget(self, conn, session_id):
+        """Delete the oldest turns beyond the budget, keeping the newest; return them oldest first."""
+        summary = conn.execute("SELECT summary FROM sessions WHERE id = ?", (session_id,)).fetchone()[0]
+        turns = conn.execute(
+            "SELECT seq, question, answer FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        used = estimate_tokens(summary) + sum(estimate_tokens(q) + estimate_tokens(a) for _, q, a in turns)
+        evicted = []
+        while len(turns) - len(evicted) > 1 and used > self.token_budget:
+            seq, question, answer = turns[len(evicted)]
+            used -= estimate_tokens(question) + estimate_tokens(answer)
+            evicted.append((seq, question, answer))
+        if evicted:
+            conn.executemany("DELETE FROM turns WHERE seq = ?", [(seq,) for seq, _, _ in evicted])
+        return [(question, answer) for _, question, answer in evicted]
+
+    def _fold_into_summary(self, session_id, evicted):
+        with self._lock:
+            row = self._db().execute("SELECT summary FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return
+        prompt = SUMMARY_PROMPT.format(
+            max_words=int(self.summary_budget * 0.75),
+            summary=row[0] or "(none)",
+            lines=format_chat_history(evicted)
+        )
+        try:
+            summary = self.llm.invoke(prompt).strip()
+        except Exception as e:
+            logger.error(f"Failed to summarize conversation {session_id}: {e}")
+            return
+        with self._lock:
+            self._db().execute(
+                "UPDATE sessions SET summary = ? WHERE id = ?",
+                (truncate_to_tokens(summary, self.summary_budget), session_id)
+            )
+
+    def stats(self):
+        with self._lock:
+            sessions = self._db().execute(
+                "SELECT COUNT(*) FROM sessions WHERE last_used >= ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+        return {"sessions": sessions, "token_budget": self.token_budget, "summarize": self.summarize}
@@ -0,0 +1,95 @@
+# document_cache.py
+
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from embeding import index_write_lock, load_vectorstore, save_vectorstore
+from index_store import current_version
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_CACHE_DIR = os.environ.get("RAG_DOCUMENT_CACHE_DIR", "document_cache")
+DOCUMENT_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_DOCUMENT_CACHE_MAX_ENTRIES", "32"))
+# Per-document stores kept deserialized in memory
+DOCUMENT_CACHE_RESIDENT = int(os.environ.get("RAG_DOCUMENT_CACHE_RESIDENT", "4"))
+
+
+class DocumentIndexCache:
+    """Bounded on-disk LRU of per-document FAISS indexes keyed by content fingerprint.
+
+    Each entry lives in ``<cache_dir>/<fingerprint>/``; its mtime records the
+    last access and the oldest entries are removed once ``max_entries`` is
+    exceeded. The most recently used stores are also kept loaded in memory.
+    """
+
+    def __init__(self, cache_dir=DOCUMENT_CACHE_DIR, max_entries=DOCUMENT_CACHE_MAX_ENTRIES,
+                 resident=DOCUMENT_CACHE_RESIDENT):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.resident = resident
+        self.hits = 0
+        self.misses = 0
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, fingerprint):
+        return os.path.join(self.cache_dir, fingerprint)
+
+    def get(self, fingerprint, embedding_model):
+        """Return the cached store for ``fingerprint`` or None."""
+        path = self._entry_path(fingerprint)
+        with self._lock:
+            vectorstore = self._loaded.get(fingerprint)
+            if vectorstore is not None:
+                self._loaded.move_to_end(fingerprint)
+        if vectorstore is None:
+            try:
+                vectorstore = load_vectorstore(embedding_model, path)
+            except Exception as e:
+                logger.warning(f"Discarding unreadable document index {path}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+                vectorstore = None
+            if vectorstore is None:
+                self.misses += 1
+                return None
+            self._remember(fingerprint, vectorstore)
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return vectorstore
+
+    def put(self, fingerprint, vectorstore):
+        path = self._entry_path(fingerprint)
+        with index_write_lock(path):
+            # A concurrent /ask for the same document may have committed it first
+            if current_version(path) is None:
+                save_vectorstore(vectorstore, path)
+        self._remember(fingerprint, vectorstore)
+        self._evict()
+
+    def _remember(self, fingerprint, vectorstore):
+        with self._lock:
+            self._loaded[fingerprint] = vectorstore
+            self._loaded.move_to_end(fingerprint)
+            while len(self._loaded) > self.resident:
+                self._loaded.popitem(last=False)
+
+    def _evict(self):
+        entries = [
+            entry for entry in os.scandir(self.cache_dir)
+            if entry.is_dir() and not entry.name.startswith(".")
+        ]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            with self._lock:
+                self._loaded.pop(entry.name, None)
+            shutil.rmtree(entry.path, ignore_errors=True)
+            logger.info(f"Evicted cached document index {entry.name}.")
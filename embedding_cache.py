@@ -0,0 +1,327 @@
+# embedding_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("RAG_EMBEDDING_CACHE_DIR", "embedding_cache")
+CACHE_MAX_BYTES = int(os.environ.get("RAG_EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Recent query embeddings kept in memory; a question is often embedded twice per
+# request (answer cache lookup, then retrieval)
+QUERY_CACHE_SIZE = int(os.environ.get("RAG_QUERY_CACHE_SIZE", "256"))
+
+# sha256 digest of (model name, normalized text)
+KEY_BYTES = 32
+# Positions in state.i8, the counters shared by every process using the cache
+_GENERATION, _TICK, _LAYOUT = range(3)
+
+
+def normalize_text(text):
+    """Collapse whitespace so that re-flowed but otherwise identical chunks share a key."""
+    return " ".join(text.split())
+
+
+def cache_key(model_name, text):
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).digest()
+
+
+class EmbeddingCache:
+    """Persistent float32 vector cache with LRU eviction.
+
+    Three memory-mapped arrays share one slot numbering:
+
+    - ``vectors.f32``: ``(capacity, dim)`` float32 embeddings
+    - ``keys.bin``: ``(capacity, 32)`` sha256 keys
+    - ``ticks.i8``: ``(capacity,)`` last-access counter, 0 marks a free slot
+
+    Capacity is derived from ``max_bytes``; an existing cache of another
+    capacity is resized when it is opened, keeping its most recently used
+    vectors. Updates touch only the affected slots, so the key index never
+    has to be rewritten as a whole.
+
+    Several processes (server workers, ``ingest.py``) may share a
+    ``cache_dir``: every access holds an exclusive ``flock`` on ``.lock``,
+    and ``state.i8`` counts writes and re-creations so that a process
+    re-reads the slot index, or re-maps the files, after another one
+    changed them.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._state = None
+        self._generation = 0
+        self._layout = 0
+        self._dim = None
+        self._capacity = 0
+        self._slots = {}
+        self._free = []
+        try:
+            with self._locked(sync=False):
+                self._open_existing(resize=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding cache in {cache_dir}: {e}")
+            self._dim = None
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    @contextmanager
+    def _locked(self, sync=True):
+        """Hold the cache against other threads and processes, picking up their changes first."""
+        with self._lock:
+            if self._lock_file is None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._lock_file = open(self._path(".lock"), "a")
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                if self._state is None:
+                    self._open_state()
+                if sync:
+                    self._sync()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open_state(self):
+        path = self._path("state.i8")
+        mode = "r+" if os.path.exists(path) else "w+"
+        self._state = np.memmap(path, dtype=np.int64, mode=mode, shape=(3,))
+        self._generation = int(self._state[_GENERATION])
+        self._layout = int(self._state[_LAYOUT])
+
+    def _sync(self):
+        """Re-map or re-index the cache if another process changed it since our last access."""
+        if int(self._state[_LAYOUT]) != self._layout:
+            self._layout = int(self._state[_LAYOUT])
+            self._open_existing(resize=False)
+        elif int(self._state[_GENERATION]) != self._generation and self._dim is not None:
+            self._index()
+        self._generation = int(self._state[_GENERATION])
+
+    def _open_existing(self, resize):
+        self._dim = None
+        self._capacity = 0
+        self._slots = {}
+        self._free = []
+        meta_path = self._path("meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self._map(meta["dim"], meta["capacity"], mode="r+")
+        logger.info(f"Embedding cache loaded with {len(self._slots)} entries from {self.cache_dir}.")
+        capacity = self._capacity_for(meta["dim"])
+        if resize and capacity != meta["capacity"]:
+            self._resize(capacity)
+
+    def _capacity_for(self, dim):
+        return max(1, self.max_bytes // (dim * 4 + KEY_BYTES + 8))
+
+    def _map(self, dim, capacity, mode):
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self._keys = np.memmap(self._path("keys.bin"), dtype=np.uint8, mode=mode, shape=(capacity, KEY_BYTES))
+        self._ticks = np.memmap(self._path("ticks.i8"), dtype=np.int64, mode=mode, shape=(capacity,))
+        self._dim = dim
+        self._capacity = capacity
+        self._index()
+        if capacity:
+            self._state[_TICK] = max(int(self._state[_TICK]), int(self._ticks.max()))
+
+    def _index(self):
+        """Rebuild the key -> slot index and the free list from the mapped files."""
+        occupied = np.flatnonzero(self._ticks)
+        self._slots = {self._keys[i].tobytes(): int(i) for i in occupied}
+        self._free = [int(i) for i in np.flatnonzero(self._ticks == 0)[::-1]]
+
+    def _next_tick(self):
+        self._state[_TICK] += 1
+        return int(self._state[_TICK])
+
+    def _create(self, dim, capacity=None):
+        meta_path = self._path("meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        capacity = capacity or self._capacity_for(dim)
+        self._map(dim, capacity, mode="w+")
+        # meta.json is written last so a half-created cache is recreated on next start
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "capacity": capacity}, f)
+        self._state[_LAYOUT] += 1
+        self._layout = int(self._state[_LAYOUT])
+        self._state.flush()
+        logger.info(f"Created embedding cache in {self.cache_dir} with room for {capacity} vectors.")
+
+    def _resize(self, capacity):
+        """Re-create the cache with ``capacity`` slots, keeping the most recently used vectors."""
+        previous = self._capacity
+        keep = np.argsort(self._ticks)[::-1][:capacity]
+        keep = np.sort(keep[np.asarray(self._ticks)[keep] > 0])
+        vectors = np.array(self._vectors[keep])
+        keys = np.array(self._keys[keep])
+        ticks = np.array(self._ticks[keep])
+        self._vectors = self._keys = self._ticks = None
+        self._create(self._dim, capacity)
+        count = len(keep)
+        self._vectors[:count] = vectors
+        self._keys[:count] = keys
+        self._ticks[:count] = ticks
+        self._flush()
+        self._index()
+        logger.info(
+            f"Resized embedding cache in {self.cache_dir} from {previous} to {capacity} vectors "
+            f"to match RAG_EMBEDDING_CACHE_MAX_MB, keeping {count} entries."
+        )
+
+    def _flush(self):
+        self._vectors.flush()
+        self._keys.flush()
+        self._ticks.flush()
+        self._state.flush()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get_many(self, keys):
+        """Return a list aligned with ``keys`` holding cached vectors or None."""
+        results = []
+        with self._locked():
+            for key in keys:
+                slot = self._slots.get(key)
+                # The slot may have been reused for another key by another process
+                if slot is not None and (not self._ticks[slot] or self._keys[slot].tobytes() != key):
+                    del self._slots[key]
+                    slot = None
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._ticks[slot] = self._next_tick()
+                results.append(np.array(self._vectors[slot]))
+        return results
+
+    def put_many(self, keys, vectors):
+        if not len(keys):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._locked():
+            if self._dim != vectors.shape[1]:
+                if self._dim is not None:
+                    logger.warning(f"Embedding dimension changed from {self._dim} to {vectors.shape[1]}; resetting cache.")
+                self._create(vectors.shape[1])
+            new_keys = [k for k in dict.fromkeys(keys) if k not in self._slots]
+            self._evict(len(new_keys) - len(self._free))
+            for key, vector in zip(keys, vectors):
+                slot = self._slots.get(key)
+                if slot is None:
+                    if not self._free:
+                        break
+                    slot = self._free.pop()
+                    self._slots[key] = slot
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._ticks[slot] = self._next_tick()
+            self._state[_GENERATION] += 1
+            self._generation = int(self._state[_GENERATION])
+            self._flush()
+
+    def _evict(self, count):
+        """Free the ``count`` least recently used slots."""
+        if count <= 0:
+            return
+        count = min(count, len(self._slots))
+        ticks = np.where(self._ticks == 0, np.iinfo(np.int64).max, self._ticks)
+        for slot in np.argpartition(ticks, count - 1)[:count]:
+            slot = int(slot)
+            key = self._keys[slot].tobytes()
+            self._slots.pop(key, None)
+            self._ticks[slot] = 0
+            self._free.append(slot)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model."""
+
+    def __init__(self, model, model_name, cache=None, query_cache_size=QUERY_CACHE_SIZE):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_name, text) for text in texts]
+        try:
+            cached = self.cache.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            cached = [None] * len(texts)
+
+        missing = {}
+        for key, text, vector in zip(keys, texts, cached):
+            if vector is None:
+                missing.setdefault(key, text)
+
+        fresh = {}
+        if missing:
+            vectors = self.model.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            try:
+                self.cache.put_many(list(missing.keys()), vectors)
+            except Exception as e:
+                logger.warning(f"Failed to write embeddings to cache: {e}")
+        logger.info(f"Embedded {len(missing)} chunks, {len(texts) - len(missing)} served from cache.")
+
+        return [
+            vector.tolist() if vector is not None else list(fresh[key])
+            for key, vector in zip(keys, cached)
+        ]
+
+    def embed_query(self, text):
+        with self._queries_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                return vector
+        vector = self.model.embed_query(text)
+        with self._queries_lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Process-wide cache instance shared by the API and the CLI pipeline."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
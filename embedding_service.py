@@ -0,0 +1,154 @@
+# embedding_service.py
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import STAGE_SECONDS, VECTORS
+
+logger = logging.getLogger(__name__)
+
+# Texts per forward pass, for both ingest jobs and micro-batched queries
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "32"))
+# How long the first query of a micro-batch waits for others to join it
+EMBED_MAX_WAIT_MS = float(os.environ.get("RAG_EMBED_MAX_WAIT_MS", "5"))
+# Queries allowed to wait for a batch; further callers block until there is room
+EMBED_MAX_QUEUE = int(os.environ.get("RAG_EMBED_MAX_QUEUE", "1024"))
+# Torch intra-op threads (0 = half the CPUs, leaving room for extraction and the event loop)
+EMBED_TORCH_THREADS = int(os.environ.get("RAG_EMBED_TORCH_THREADS", "0"))
+
+
+def configure_torch_threads(num_threads=EMBED_TORCH_THREADS):
+    """Pin torch's intra-op pool and disable inter-op parallelism; returns the thread count."""
+    import torch
+
+    if num_threads <= 0:
+        num_threads = max(1, (os.cpu_count() or 2) // 2)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before torch has started any parallel work
+        pass
+    logger.info(f"Torch configured with {num_threads} intra-op threads.")
+    return num_threads
+
+
+class _PendingQuery:
+    __slots__ = ("text", "vector", "error", "done")
+
+    def __init__(self, text):
+        self.text = text
+        self.vector = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingService(Embeddings):
+    """Batching front end to a sentence-transformers embedding model.
+
+    ``embed_documents`` splits large ingest jobs into ``batch_size`` slices,
+    so only one slice of activations is in memory at a time.
+    ``embed_query`` puts the query on a bounded queue. A background thread
+    collects queued queries for up to ``max_wait_ms`` or until ``batch_size``
+    have arrived, then encodes them in one forward pass. Forward passes are
+    serialized, because torch already parallelises inside each one.
+    """
+
+    def __init__(self, model, batch_size=EMBED_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS,
+                 max_queue=EMBED_MAX_QUEUE):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._model_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._batches = 0
+        self._vectors = 0
+        self._busy_seconds = 0.0
+        self._last_batch_size = 0
+        self._query_batches = 0
+        self._queries = 0
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._encode(texts[start:start + self.batch_size], kind="document"))
+        return vectors
+
+    def embed_query(self, text):
+        self._ensure_worker()
+        pending = _PendingQuery(text)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vector
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self._encode([pending.text for pending in batch], kind="query")
+                for pending, vector in zip(batch, vectors):
+                    pending.vector = vector
+            except Exception as e:
+                logger.error(f"Failed to embed a batch of {len(batch)} queries: {e}")
+                for pending in batch:
+                    pending.error = e
+            finally:
+                with self._stats_lock:
+                    self._query_batches += 1
+                    self._queries += len(batch)
+                for pending in batch:
+                    pending.done.set()
+
+    def _encode(self, texts, kind):
+        with self._model_lock:
+            started = time.perf_counter()
+            vectors = self.model.embed_documents(texts)
+            elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=f"embed_{kind}")
+        VECTORS.inc(len(texts), kind=kind)
+        with self._stats_lock:
+            self._batches += 1
+            self._vectors += len(texts)
+            self._busy_seconds += elapsed
+            self._last_batch_size = len(texts)
+        return vectors
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "batch_size_limit": self.batch_size,
+                "batches": self._batches,
+                "vectors": self._vectors,
+                "last_batch_size": self._last_batch_size,
+                "avg_batch_size": self._vectors / self._batches if self._batches else 0.0,
+                "avg_query_batch_size": self._queries / self._query_batches if self._query_batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+                "vectors_per_second": self._vectors / self._busy_seconds if self._busy_seconds else 0.0,
+            }
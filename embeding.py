@@ -3,17 +3,17 @@
 import logging
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from langchain_huggingface import HuggingFacePipeline
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-from langchain_ollama import OllamaLLM
-import torch
 import os
+import hashlib
+import re
 
-# Importing functions from extract_text.py
-import extract_text
+import index_store
+from embedding_cache import CachedEmbeddings
+from embedding_service import EMBED_BATCH_SIZE, EmbeddingService, configure_torch_threads
+from conversation import format_chat_history
+from metrics import CHUNKS, LLMMetricsHandler, stage_timer
+from retrieval import make_retriever
 
 # Configure Logging
 logging.basicConfig(
@@ -25,6 +25,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# مسیر پیش‌فرض ایندکس FAISS
+INDEX_PATH = "faiss_index"
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Ollama server and model used for answers
+OLLAMA_BASE_URL = os.environ.get("RAG_OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.environ.get("RAG_OLLAMA_MODEL", "llama3.2:3b")
+
+# Named collections get their own index shard under this directory;
+# the default collection keeps using INDEX_PATH
+COLLECTIONS_DIR = os.environ.get("RAG_COLLECTIONS_DIR", "collections")
+DEFAULT_COLLECTION = "default"
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+def index_write_lock(index_path=INDEX_PATH):
+    """Serialises load → modify → save cycles on an index, across processes too."""
+    return index_store.write_lock(index_path)
+
+# Chunks shorter than this carry too little content to be worth embedding
+MIN_CHUNK_LENGTH = 50
+
+# Tables longer than this (in characters) are split between rows, each piece
+# repeating the header row; shorter ones are kept whole as a single chunk
+TABLE_CHUNK_SIZE = int(os.environ.get("RAG_TABLE_CHUNK_SIZE", "2000"))
+
 # مرحله 1: خواندن متن از فایل استخراج شده
 def load_text(file_path):
     try:
@@ -51,24 +77,104 @@ def split_text(text, chunk_size=1000, chunk_overlap=200):
         logger.error(f"Failed to split text: {e}")
         return []
 
+def _is_table_row(line):
+    return len(line) > 1 and line.startswith("|") and line.endswith("|")
+
+def page_blocks(page_text):
+    """Split a page's text into ``(is_table, text)`` blocks, in page order.
+
+    ``table_converter`` writes tables as runs of ``|cell|cell|`` lines;
+    the text between them forms the other blocks.
+    """
+    block, block_is_table = [], False
+    for line in page_text.split("\n"):
+        is_table = _is_table_row(line.strip())
+        if block and is_table != block_is_table:
+            yield block_is_table, "\n".join(block)
+            block = []
+        block_is_table = is_table
+        block.append(line)
+    if block:
+        yield block_is_table, "\n".join(block)
+
+def split_table(table, max_size=TABLE_CHUNK_SIZE):
+    """Yield ``table`` whole, or in pieces of whole rows that each start with the header row."""
+    if len(table) <= max_size:
+        yield table
+        return
+    header, *rows = table.split("\n")
+    piece, piece_size = [header], len(header)
+    for row in rows:
+        if len(piece) > 1 and piece_size + 1 + len(row) > max_size:
+            yield "\n".join(piece)
+            piece, piece_size = [header], len(header)
+        piece.append(row)
+        piece_size += 1 + len(row)
+    if len(piece) > 1:
+        yield "\n".join(piece)
+
+def split_pages(pages, chunk_size=1000, chunk_overlap=200, table_chunk_size=TABLE_CHUNK_SIZE):
+    """Split page texts one page at a time, yielding ``(page_number, chunk)``.
+
+    Page numbers start at 1. Chunks never span two pages, so every chunk can
+    be attributed to the page it came from. Tables written as ``|cell|``
+    rows, which only layout extraction (``RAG_EXTRACT_MODE=layout``)
+    produces, are never cut mid-row: each becomes one chunk (see
+    ``split_table``), and only the text around them goes through the
+    character splitter. ``pages`` may be any iterable,
+    so a document is chunked as its pages are extracted.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    for page_number, page_text in enumerate(pages, 1):
+        for is_table, block in page_blocks(page_text):
+            if is_table:
+                chunks = split_table(block.strip(), table_chunk_size)
+            else:
+                chunks = text_splitter.split_text(block)
+            for chunk in chunks:
+                yield page_number, chunk
+
 # مرحله 3: ایجاد اشیاء Document از بخش‌های متن
 def create_documents(chunks, source="extracted_text.txt"):
     try:
-        # Define a minimum length for meaningful content
-        MIN_LENGTH = 50
-        documents = [Document(page_content=chunk, metadata={"source": source}) for chunk in chunks if len(chunk.strip()) >= MIN_LENGTH]
+        documents = [Document(page_content=chunk, metadata={"source": source}) for chunk in chunks if len(chunk.strip()) >= MIN_CHUNK_LENGTH]
         logger.info(f"Created {len(documents)} Document objects after filtering.")
         return documents
     except Exception as e:
         logger.error(f"Failed to create Document objects: {e}")
         return []
 
+def create_page_documents(pages, source):
+    """Documents for the chunks of ``pages``, each tagged with its ``source`` and ``page``."""
+    with stage_timer("split"):
+        documents = [
+            Document(page_content=chunk, metadata={"source": source, "page": page_number})
+            for page_number, chunk in split_pages(pages)
+            if len(chunk.strip()) >= MIN_CHUNK_LENGTH
+        ]
+    CHUNKS.inc(len(documents))
+    return documents
+
 # مرحله 4: ایجاد embedding با استفاده از مدل لوکال
-def create_embeddings(documents):
+def create_embeddings(documents=None):
     try:
-        embedding_model = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
+        # torch and transformers come in with the model, not with this module
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        configure_torch_threads()
+        # Queries are micro-batched and ingest jobs sliced by EmbeddingService;
+        # only chunks missing from the embedding cache reach the model
+        service = EmbeddingService(
+            HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL_NAME,
+                encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
+            )
         )
+        embedding_model = CachedEmbeddings(service, EMBEDDING_MODEL_NAME)
         logger.info("Embedding model initialized.")
         return embedding_model
     except Exception as e:
@@ -76,13 +182,111 @@ def create_embeddings(documents):
         return None
 
 # مرحله 5: ذخیره در وکتور دیتابیس FAISS
-def store_embeddings(documents, embedding_model):
+def document_id(source):
+    """Stable identifier for a document, derived from its source name."""
+    return hashlib.sha1(str(source).encode("utf-8")).hexdigest()[:16]
+
+def collection_path(collection=DEFAULT_COLLECTION):
+    """Index directory of ``collection``; raises ValueError for unsafe names."""
+    if collection == DEFAULT_COLLECTION:
+        return INDEX_PATH
+    if not _COLLECTION_NAME.match(collection or ""):
+        raise ValueError(f"Invalid collection name {collection!r}")
+    return os.path.join(COLLECTIONS_DIR, collection)
+
+def list_collections():
+    """Named collections with a committed shard, excluding the default one."""
+    if not os.path.isdir(COLLECTIONS_DIR):
+        return []
+    return sorted(
+        entry.name for entry in os.scandir(COLLECTIONS_DIR)
+        if _COLLECTION_NAME.match(entry.name) and index_store.read_meta(entry.path) is not None
+    )
+
+def chunk_ids(doc_id, documents):
+    return [f"{doc_id}:{i}" for i in range(len(documents))]
+
+def load_vectorstore(embedding_model, index_path=INDEX_PATH, writable=False):
+    """Open the persisted index, or return None if none has been saved yet.
+
+    The index is memory-mapped and chunk texts are read from SQLite on
+    demand; pass ``writable=True`` to get a staged copy that can be
+    modified and committed with ``save_vectorstore``.
+    """
+    return index_store.load_vectorstore(embedding_model, index_path, writable=writable)
+
+def save_vectorstore(faiss_db, index_path=INDEX_PATH):
+    """Commit the index as a new version; readers see the old or the new one, never a partial save."""
+    index_store.save_vectorstore(faiss_db, index_path)
+
+def ids_for_document(faiss_db, doc_id):
+    prefix = f"{doc_id}:"
+    if isinstance(faiss_db.docstore, index_store.SQLiteDocstore):
+        return faiss_db.docstore.ids_with_prefix(prefix)
+    return [i for i in faiss_db.index_to_docstore_id.values() if i.startswith(prefix)]
+
+def build_vectorstore(documents, embedding_model, doc_id=None):
+    """Build an in-memory index for a single document without touching the global one."""
     try:
-        faiss_db = FAISS.from_documents(documents, embedding_model)
-        # Save the FAISS index
-        faiss_db.save_local("faiss_index")
+        if doc_id is None:
+            doc_id = document_id(documents[0].metadata.get("source", ""))
+        for chunk, document in enumerate(documents):
+            document.metadata["doc_id"] = doc_id
+            document.metadata["chunk"] = chunk
+        faiss_db = FAISS.from_documents(documents, embedding_model, ids=chunk_ids(doc_id, documents))
+        logger.info(f"Built document index with {faiss_db.index.ntotal} vectors.")
+        return faiss_db
+    except Exception as e:
+        logger.error(f"Failed to build document index: {e}")
+        return None
+
+def store_embeddings(documents, embedding_model, index_path=INDEX_PATH, doc_id=None, rebuild=False,
+                     vectors=None):
+    """Add one document's chunks to the on-disk index.
+
+    Only ``documents`` are embedded; existing vectors are kept. Chunks are
+    stored under ``<doc_id>:<n>`` ids so that re-ingesting the same document
+    replaces its previous vectors instead of duplicating them. Pass
+    ``rebuild=True`` to discard the existing index and start from scratch,
+    and ``vectors`` to index embeddings computed beforehand.
+
+    Returns None on failure, except that ``index_store.LegacyIndexError``
+    is raised for an index that still has to be converted.
+    """
+    try:
+        if doc_id is None:
+            doc_id = document_id(documents[0].metadata.get("source", ""))
+        for chunk, document in enumerate(documents):
+            document.metadata["doc_id"] = doc_id
+            document.metadata["chunk"] = chunk
+        ids = chunk_ids(doc_id, documents)
+        texts = [document.page_content for document in documents]
+        metadatas = [document.metadata for document in documents]
+        if vectors is None:
+            vectors = embedding_model.embed_documents(texts)
+        text_embeddings = list(zip(texts, vectors))
+
+        with index_write_lock(index_path):
+            faiss_db = None if rebuild else load_vectorstore(embedding_model, index_path, writable=True)
+            if faiss_db is None:
+                faiss_db = FAISS.from_embeddings(text_embeddings, embedding_model, metadatas=metadatas, ids=ids)
+            else:
+                try:
+                    stale_ids = ids_for_document(faiss_db, doc_id)
+                    if stale_ids:
+                        faiss_db.delete(stale_ids)
+                        logger.info(f"Replaced {len(stale_ids)} existing vectors of document {doc_id}.")
+                    faiss_db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                except Exception:
+                    index_store.discard(faiss_db)
+                    raise
+            save_vectorstore(faiss_db, index_path)
         logger.info(f"FAISS index has {faiss_db.index.ntotal} vectors and saved to disk.")
         return faiss_db
+    except index_store.LegacyIndexError as e:
+        # Not retryable: the operator has to convert the index first
+        logger.error(f"Cannot add to the index: {e}")
+        raise
     except Exception as e:
         logger.error(f"Failed to store embeddings in FAISS: {e}")
         return None
@@ -90,14 +294,17 @@ def store_embeddings(documents, embedding_model):
 # مرحله 6: استفاده از مدل زبانی لوکال برای پاسخ‌دهی
 def load_local_llm():
     try:
+        from langchain_ollama import OllamaLLM
+
         # Initialize Ollama with the desired model
         llm = OllamaLLM(
-            model="llama3.2:3b",  # یا هر مدل دیگری که در Ollama نصب دارید
-            base_url="http://localhost:11434",
+            model=OLLAMA_MODEL,  # یا هر مدل دیگری که در Ollama نصب دارید
+            base_url=OLLAMA_BASE_URL,
             temperature=0.7,
             top_p=0.9,
             num_ctx=2048,  # Maximum context length
             repeat_penalty=1.2,
+            callbacks=[LLMMetricsHandler()],  # Latency, time to first token and token counts
         )
         
         logger.info("Ollama LLM initialized successfully.")
@@ -106,10 +313,49 @@ def load_local_llm():
         logger.error(f"Failed to initialize Ollama LLM: {e}")
         return None
 
+def llm_settings(llm):
+    """Generation settings that determine an answer, used to scope cached answers."""
+    keys = ("model", "base_url", "temperature", "top_p", "num_ctx", "repeat_penalty")
+    return tuple((key, getattr(llm, key, None)) for key in keys)
+
+# Same wording as the "stuff" prompt ConversationalRetrievalChain uses by default
+QA_PROMPT_TEMPLATE = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:"""
+
+def build_answer_prompt(question, documents):
+    """Prompt for answering ``question`` from retrieved ``documents``, for token streaming."""
+    context = "\n\n".join(document.page_content for document in documents)
+    return QA_PROMPT_TEMPLATE.format(context=context, question=question)
+
+async def acondense_question(llm, question, chat_history):
+    """Rephrase a follow-up as a standalone question, as ConversationalRetrievalChain does."""
+    if not chat_history:
+        return question
+    from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+
+    prompt = CONDENSE_QUESTION_PROMPT.format(
+        chat_history=format_chat_history(chat_history),
+        question=question
+    )
+    return (await llm.ainvoke(prompt)).strip()
+
+def describe_sources(documents):
+    """JSON-serialisable summary of retrieved documents for API responses."""
+    return [
+        {key: document.metadata[key] for key in ("source", "page", "doc_id") if key in document.metadata}
+        for document in documents
+    ]
+
 # مرحله 7: تعریف زنجیره ConversationalRetrievalChain
-def create_qa_chain(llm, vectorstore):
+def create_qa_chain(llm, vectorstore, retriever=None):
     try:
-        retriever = vectorstore.as_retriever()
+        from langchain.chains import ConversationalRetrievalChain
+
+        retriever = retriever or make_retriever(vectorstore)
         qa_chain = ConversationalRetrievalChain.from_llm(
             llm=llm,
             retriever=retriever,
@@ -126,44 +372,13 @@ def create_qa_chain(llm, vectorstore):
 
 # اجرای برنامه
 if __name__ == "__main__":
-    # مسیر فولدر پی‌دی‌اف‌ها و فایل خروجی متن استخراج شده
+    # مسیر فولدر پی‌دی‌اف‌ها
     pdf_folder_path = "/Users/shayanhashemi/Downloads/indice Vert/Fastapi/fastapi-docgpt"  # Replace with your PDF folder path
-    extracted_text_path = "extracted_text.txt"  # Output text file path
-    
-    # مرحله 0: استخراج متن از پی‌دی‌اف‌ها
-    try:
-        logger.info("Starting text extraction from PDFs.")
-        extract_text.extract_text_from_folder(pdf_folder_path, extracted_text_path)
-    except Exception as e:
-        logger.error(f"Failed to extract text from folder: {e}")
-        exit(1)
-    
-    # مرحله 1: بارگذاری متن استخراج شده
-    text = load_text(extracted_text_path)
-    if not text:
-        logger.error("No text loaded from the extracted file. Exiting.")
-        exit(1)
-    
-    # مرحله 2: تقسیم متن
-    chunks = split_text(text)
-    if not chunks:
-        logger.error("No text chunks created. Exiting.")
-        exit(1)
-    
-    # مرحله 3: ایجاد اشیاء Document
-    documents = create_documents(chunks, source=extracted_text_path)
-    if not documents:
-        logger.error("No Document objects created. Exiting.")
-        exit(1)
-    
-    # مرحله 4: ایجاد embedding
-    embedding_model = create_embeddings(documents)
-    if not embedding_model:
-        logger.error("Embedding model not initialized. Exiting.")
-        exit(1)
     
-    # مرحله 5: ذخیره در FAISS
-    vectorstore = store_embeddings(documents, embedding_model)
+    # مرحله 0 تا 5: استخراج، تقسیم، embedding و ذخیره در FAISS به صورت جریانی
+    from ingest import ingest_folder
+    logger.info("Starting ingestion of PDFs.")
+    vectorstore = ingest_folder(pdf_folder_path)
     if not vectorstore:
         logger.error("FAISS vector store not created. Exiting.")
         exit(1)
@@ -1,133 +1,325 @@
 # extract_text.py
 
 import os
-import PyPDF2
-import pdfplumber
-from PIL import Image
-from pdf2image import convert_from_path
-import pytesseract
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextContainer, LTChar, LTFigure
+import threading
+import time
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import logging
-import fitz  # PyMuPDF
+
+# pdfplumber/pdfminer, PyMuPDF (fitz), PIL and pytesseract are imported by the
+# functions that use them, so importing this module (and the app) stays cheap
+# and OCR dependencies are only loaded once a figure is actually found
+
+from metrics import PAGES, stage_timer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf_only(pdf_path):
-    """استخراج متن از یک فایل PDF و بازگرداندن متن به صورت رشته."""
-    text_per_page = {}
-    image_flag = False
-    try:
-        pdfFileObj = open(pdf_path, 'rb')
-        pdfReader = PyPDF2.PdfReader(pdfFileObj)
-    except Exception as e:
-        logger.error(f"Failed to open PDF {pdf_path}: {e}")
-        return ""
+# Resolution used when rasterizing figures for OCR
+OCR_DPI = 200
+
+# Parallel extraction: worker processes (1 = extract in the calling process),
+# seconds allowed per page before a shard is abandoned (0 = no limit) and
+# pages handed to a worker at a time (0 = derive from page and worker count)
+EXTRACT_WORKERS = int(os.environ.get("RAG_EXTRACT_WORKERS", "1"))
+EXTRACT_PAGE_TIMEOUT = float(os.environ.get("RAG_EXTRACT_PAGE_TIMEOUT", "0"))
+EXTRACT_PAGES_PER_TASK = int(os.environ.get("RAG_EXTRACT_PAGES_PER_TASK", "0"))
+
+# How /upload, /ask and ingest.py read PDFs: "plain" (pdfplumber text, fast)
+# or "layout" (tables kept as tables and figures OCR'd, several times slower)
+EXTRACT_MODE = os.environ.get("RAG_EXTRACT_MODE", "plain")
 
+# Workers start from a clean interpreter rather than a fork of the server,
+# which holds model weights, torch thread pools and open sockets
+EXTRACT_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+def _iter_layout_pages(pdf_path, start=0, stop=None):
+    """Yield ``(pagenum, page_content)`` for pages ``[start, stop)``.
+
+    The document is parsed once: pdfplumber yields each page's pdfminer
+    layout and its tables, and the table objects found on a page are reused
+    for ``table_converter``. Figures are rendered in memory with PyMuPDF,
+    which is only opened when a page actually contains one.
+    """
+    import pdfplumber
+    from pdfminer.layout import LTTextContainer, LTFigure
+
+    fitz_doc = None
     try:
-        for pagenum, page_layout in enumerate(extract_pages(pdf_path)):
-            try:
-                pageObj = pdfReader.pages[pagenum]
-            except IndexError:
-                logger.warning(f"Page {pagenum} does not exist in PDF {pdf_path}.")
-                continue
+        # laparams enables pdfminer layout analysis, as extract_pages() did
+        with pdfplumber.open(pdf_path, laparams={}) as pdf:
+            for pagenum, page in enumerate(pdf.pages[start:stop], start):
+                page_text = []
+                text_from_images = []
+                page_content = []
 
-            page_text = []
-            text_from_images = []
-            page_content = []
+                try:
+                    tables = page.find_tables()
+                except Exception as e:
+                    logger.error(f"Failed to extract tables from page {pagenum}: {e}")
+                    tables = []
 
-            try:
-                pdf = pdfplumber.open(pdf_path)
-                page_tables = pdf.pages[pagenum]
-                tables = page_tables.find_tables()
-            except Exception as e:
-                logger.error(f"Failed to extract tables from page {pagenum}: {e}")
-                tables = []
+                # Extract tables; they are placed among the other elements by
+                # their position, and text inside them is not extracted twice
+                page_elements = []
+                table_boxes = []
+                for table_num, table in enumerate(tables):
+                    try:
+                        table_string = table_converter(table.extract())
+                    except Exception as e:
+                        logger.error(f"Failed to extract table {table_num} from page {pagenum}: {e}")
+                        continue
+                    if not table_string:
+                        continue
+                    table_boxes.append(table.bbox)
+                    # The trailing blank line keeps adjacent tables apart for the chunker
+                    page_elements.append((page.height - table.bbox[1], table_string + "\n"))
 
-            # Extract tables
-            for table_num in range(len(tables)):
                 try:
-                    table = extract_table(pdf_path, pagenum, table_num)
-                    table_string = table_converter(table)
-                    page_content.append(table_string)
+                    page_layout = page.layout
                 except Exception as e:
-                    logger.error(f"Failed to extract table {table_num} from page {pagenum}: {e}")
-                    continue
+                    logger.error(f"Failed to analyse layout of page {pagenum}: {e}")
+                    page_layout = []
 
-            # Sort elements by Y position (descending)
-            page_elements = [(element.y1, element) for element in page_layout]
-            page_elements.sort(key=lambda a: a[0], reverse=True)
+                # Sort elements by Y position (descending)
+                page_elements.extend((element.y1, element) for element in page_layout)
+                page_elements.sort(key=lambda a: a[0], reverse=True)
 
-            for component in page_elements:
-                element = component[1]
+                for component in page_elements:
+                    element = component[1]
 
-                # Extract text elements
-                if isinstance(element, LTTextContainer):
-                    try:
-                        line_text, _ = text_extraction(element)
-                        page_text.append(line_text)
-                        page_content.append(line_text)
-                    except Exception as e:
-                        logger.error(f"Failed to extract text from element on page {pagenum}: {e}")
+                    if isinstance(element, str):
+                        page_content.append(element)
+                        continue
 
-                # Extract image elements (if any)
-                if isinstance(element, LTFigure):
-                    try:
-                        crop_image(element, pageObj)
-                        convert_to_images('cropped_image.pdf')
-                        image_text = image_to_text('PDF_image.png')
-                        text_from_images.append(image_text)
-                        page_content.append(image_text)
-                        image_flag = True
-                    except Exception as e:
-                        logger.error(f"Failed to extract text from image on page {pagenum}: {e}")
+                    # Extract text elements
+                    if isinstance(element, LTTextContainer):
+                        if _in_table(element, table_boxes, page.height):
+                            continue
+                        try:
+                            line_text, _ = text_extraction(element)
+                            page_text.append(line_text)
+                            page_content.append(line_text)
+                        except Exception as e:
+                            logger.error(f"Failed to extract text from element on page {pagenum}: {e}")
+
+                    # Extract image elements (if any)
+                    if isinstance(element, LTFigure):
+                        try:
+                            if fitz_doc is None:
+                                import fitz  # PyMuPDF
+                                fitz_doc = fitz.open(pdf_path)
+                            image = render_figure(fitz_doc[pagenum], element)
+                            image_text = image_to_text(image)
+                            text_from_images.append(image_text)
+                            page_content.append(image_text)
+                        except Exception as e:
+                            logger.error(f"Failed to extract text from image on page {pagenum}: {e}")
+
+                yield pagenum, page_content
+
+                # Drop the page's cached layout and objects before moving on
+                page.flush_cache()
+    finally:
+        if fitz_doc is not None:
+            fitz_doc.close()
+
+def _in_table(element, table_boxes, page_height):
+    """Whether the centre of a pdfminer element lies inside one of the pdfplumber table boxes."""
+    x = (element.x0 + element.x1) / 2
+    # pdfminer measures y from the bottom of the page, pdfplumber from the top
+    y = page_height - (element.y0 + element.y1) / 2
+    return any(x0 <= x <= x1 and top <= y <= bottom for x0, top, x1, bottom in table_boxes)
+
+def _iter_plain_pages(pdf_path, start=0, stop=None):
+    """Yield ``(pagenum, text)`` using pdfplumber's plain text extraction.
+
+    Tables come out as ordinary text lines, without the ``|cell|`` rows
+    that ``split_pages`` keeps together; use layout mode for those.
+    """
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        for pagenum, page in enumerate(pdf.pages[start:stop], start):
+            yield pagenum, page.extract_text() or ""
+            page.flush_cache()
 
-            # Combine the extracted content for each page
-            dctkey = f'Page_{pagenum}'
-            text_per_page[dctkey] = page_content
+def _iter_page_strings(pdf_path, mode, start=0, stop=None):
+    if mode == "layout":
+        for pagenum, page_content in _iter_layout_pages(pdf_path, start, stop):
+            yield pagenum, '\n'.join(page_content)
+    else:
+        yield from _iter_plain_pages(pdf_path, start, stop)
 
+def _extract_page_range(pdf_path, start, stop, mode):
+    """Process-pool task: open the PDF once and extract pages ``[start, stop)``."""
+    return list(_iter_page_strings(pdf_path, mode, start, stop))
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        # A pool whose worker died (or was terminated) accepts no more tasks
+        if _executor is None or _executor_workers != workers or getattr(_executor, "_broken", False):
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(EXTRACT_START_METHOD)
+            )
+            _executor_workers = workers
+        return _executor
+
+def _terminate_executor(executor):
+    """Kill the workers of ``executor``, e.g. one stuck on a page; the next call gets a new pool.
+
+    ProcessPoolExecutor cannot stop a running task, so its processes are
+    terminated. Other extractions sharing the pool see their ranges fail
+    with BrokenProcessPool and resubmit them.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    # No public API to stop running tasks
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def page_count(pdf_path):
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def extract_page_texts(pdf_path, mode=None, workers=None, page_timeout=None, pages_per_task=None,
+                       progress=None):
+    """Return the text of every page of a PDF, in page order.
+
+    ``mode`` is ``"layout"`` (tables, text blocks and OCR of figures, as in
+    ``extract_text_from_pdf_only``) or ``"plain"`` (pdfplumber text only);
+    it defaults to ``EXTRACT_MODE``.
+    With ``workers > 1`` the pages are split into ranges that are extracted
+    in a shared process pool; each task opens the PDF once. A range that
+    fails or exceeds ``page_timeout`` seconds per page is logged and left
+    empty so the rest of the document is still returned.
+
+    ``progress(pages_done, pages_total)`` is called as pages complete.
+    """
+    with stage_timer("extract"):
+        pages = _extract_page_texts(pdf_path, mode, workers, page_timeout, pages_per_task, progress)
+    PAGES.inc(len(pages))
+    return pages
+
+def _extract_page_texts(pdf_path, mode, workers, page_timeout, pages_per_task, progress):
+    mode = EXTRACT_MODE if mode is None else mode
+    if mode not in ("layout", "plain"):
+        raise ValueError(f"Unknown extraction mode {mode!r}; use 'layout' or 'plain'")
+    workers = EXTRACT_WORKERS if workers is None else workers
+    page_timeout = EXTRACT_PAGE_TIMEOUT if page_timeout is None else page_timeout
+    pages_per_task = EXTRACT_PAGES_PER_TASK if pages_per_task is None else pages_per_task
+
+    total = page_count(pdf_path) if workers > 1 or progress is not None else 0
+    if workers <= 1 or total <= 1:
+        pages = []
+        for _, text in _iter_page_strings(pdf_path, mode):
+            pages.append(text)
+            if progress is not None:
+                progress(len(pages), total)
+        return pages
+    if pages_per_task <= 0:
+        # Around two ranges per worker balances OCR-heavy pages without reopening too often
+        pages_per_task = max(1, -(-total // (workers * 2)))
+
+    # One deadline for the whole document: every page may take page_timeout,
+    # spread over the workers; ranges still running then are abandoned
+    deadline = None
+    if page_timeout:
+        deadline = time.monotonic() + page_timeout * -(-total // workers)
+
+    executor = _get_executor(workers)
+    pending = {}
+    for start in range(0, total, pages_per_task):
+        stop = min(start + pages_per_task, total)
+        pending[executor.submit(_extract_page_range, pdf_path, start, stop, mode)] = (start, stop)
+
+    pages = [""] * total
+    pages_done = 0
+    resubmitted = set()
+    while pending:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        finished, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not finished:
+            for start, stop in sorted(pending.values()):
+                logger.error(f"Timed out extracting pages {start}-{stop - 1} of {pdf_path}.")
+            _terminate_executor(executor)
+            break
+        for future in finished:
+            start, stop = pending.pop(future)
+            try:
+                for pagenum, text in future.result():
+                    pages[pagenum] = text
+            except BrokenProcessPool:
+                if (start, stop) not in resubmitted:
+                    # The pool was replaced under us (another document timed out); run the range again
+                    resubmitted.add((start, stop))
+                    executor = _get_executor(workers)
+                    pending[executor.submit(_extract_page_range, pdf_path, start, stop, mode)] = (start, stop)
+                    continue
+                logger.error(f"Failed to extract pages {start}-{stop - 1} of {pdf_path}: worker process died")
+            except Exception as e:
+                logger.error(f"Failed to extract pages {start}-{stop - 1} of {pdf_path}: {e}")
+            pages_done += stop - start
+            if progress is not None:
+                progress(pages_done, total)
+    logger.info(f"Extracted {total} pages from {pdf_path} with {workers} workers.")
+    return pages
+
+def extract_text_from_pdf_only(pdf_path, workers=None, page_timeout=None):
+    """استخراج متن از یک فایل PDF و بازگرداندن متن به صورت رشته."""
+    try:
+        pages = extract_page_texts(pdf_path, mode="layout", workers=workers, page_timeout=page_timeout)
     except Exception as e:
         logger.error(f"Failed to extract text from PDF {pdf_path}: {e}")
-    finally:
-        pdfFileObj.close()
-        if image_flag:
-            if os.path.exists('cropped_image.pdf'):
-                os.remove('cropped_image.pdf')
-            if os.path.exists('PDF_image.png'):
-                os.remove('PDF_image.png')
+        return ""
 
     # Combine all text from all pages into one string
-    combined_text = '\n'.join(['\n'.join(text_per_page[page]) for page in text_per_page])
-    return combined_text
+    return '\n'.join(pages)
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+def extract_text_from_pdf(pdf_path: str, workers=None, page_timeout=None) -> str:
     """Extraire le texte d'un fichier PDF."""
     try:
-        text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-                text += "\n"
+        pages = extract_page_texts(pdf_path, mode="plain", workers=workers, page_timeout=page_timeout)
+        text = "".join(page + "\n" for page in pages)
         logger.info(f"Texte extrait avec succès du PDF: {pdf_path}")
         return text
     except Exception as e:
         logger.error(f"Erreur lors de l'extraction du texte du PDF {pdf_path}: {str(e)}")
         raise
 
+def iter_pdf_files(folder_path):
+    """Yield the paths of the PDF files in ``folder_path``, sorted by name."""
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.lower().endswith('.pdf'):
+            yield os.path.join(folder_path, filename)
+
 def extract_text_from_folder(folder_path, output_txt_path):
     """Extraire le texte de tous les PDFs dans un dossier."""
-    combined_text = ''
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.pdf'):
-            pdf_path = os.path.join(folder_path, filename)
-            logger.info(f"Extracting text from: {pdf_path}")
-            try:
-                pdf_text = extract_text_from_pdf(pdf_path)
-                combined_text += f"\n--- Text from {filename} ---\n" + pdf_text + "\n"
-            except Exception as e:
-                logger.error(f"Failed to process {filename}: {e}")
-                continue
+    parts = []
+    for pdf_path in iter_pdf_files(folder_path):
+        filename = os.path.basename(pdf_path)
+        logger.info(f"Extracting text from: {pdf_path}")
+        try:
+            pdf_text = extract_text_from_pdf(pdf_path)
+            parts.append(f"\n--- Text from {filename} ---\n" + pdf_text + "\n")
+        except Exception as e:
+            logger.error(f"Failed to process {filename}: {e}")
+            continue
+    combined_text = ''.join(parts)
 
     try:
         with open(output_txt_path, 'w', encoding='utf-8') as output_file:
@@ -138,38 +330,34 @@ def extract_text_from_folder(folder_path, output_txt_path):
 
     return combined_text
 
-def crop_image(element, pageObj):
-    image_left, image_top, image_right, image_bottom = element.x0, element.y0, element.x1, element.y1
-    pageObj.mediabox.lower_left = (image_left, image_bottom)
-    pageObj.mediabox.upper_right = (image_right, image_top)
+def render_figure(fitz_page, element, dpi=OCR_DPI):
+    """Rasterize the area of a pdfminer figure to an in-memory PIL image."""
+    import fitz  # PyMuPDF
+    from PIL import Image
 
-    cropped_pdf_writer = PyPDF2.PdfWriter()
-    cropped_pdf_writer.add_page(pageObj)
-    with open('cropped_image.pdf', 'wb') as cropped_pdf_file:
-        cropped_pdf_writer.write(cropped_pdf_file)
+    # pdfminer uses PDF user space (origin bottom-left); map it to MuPDF page space
+    clip = fitz.Rect(element.x0, element.y0, element.x1, element.y1) * fitz_page.transformation_matrix
+    pix = fitz_page.get_pixmap(clip=clip, dpi=dpi, alpha=False)
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
 
-def convert_to_images(input_file):
+def image_to_text(image):
+    """Run Tesseract on a PIL image, or on an image file if given a path."""
     try:
-        images = convert_from_path(input_file)
-        if images:
-            image = images[0]
-            output_file = 'PDF_image.png'
-            image.save(output_file, 'PNG')
-            logger.info(f"Converted {input_file} to image {output_file}.")
-    except Exception as e:
-        logger.error(f"Failed to convert {input_file} to image: {e}")
+        import pytesseract
+        from PIL import Image
 
-def image_to_text(image_path):
-    try:
-        img = Image.open(image_path)
+        img = Image.open(image) if isinstance(image, (str, os.PathLike)) else image
         text = pytesseract.image_to_string(img)
-        logger.info(f"Extracted text from image {image_path}.")
+        logger.info(f"Extracted text from image of size {img.size}.")
         return text
     except Exception as e:
-        logger.error(f"Failed to extract text from image {image_path}: {e}")
+        logger.error(f"Failed to extract text from image: {e}")
         return ""
 
 def text_extraction(element):
+    from pdfminer.layout import LTChar
+
     line_text = element.get_text()
     line_formats = []
     for text_line in element:
@@ -180,10 +368,12 @@ def text_extraction(element):
     return (line_text, format_per_line)
 
 def extract_table(pdf_path, page_num, table_num):
+    import pdfplumber
+
     try:
-        pdf = pdfplumber.open(pdf_path)
-        table_page = pdf.pages[page_num]
-        table = table_page.extract_tables()[table_num]
+        with pdfplumber.open(pdf_path) as pdf:
+            table_page = pdf.pages[page_num]
+            table = table_page.extract_tables()[table_num]
         return table
     except Exception as e:
         logger.error(f"Failed to extract table {table_num} from page {page_num}: {e}")
@@ -5,12 +5,13 @@ import { InputTextarea } from 'primeng/inputtextarea';
 import { ButtonModule } from 'primeng/button';
 import { CardModule } from 'primeng/card';
 import { AvatarModule } from 'primeng/avatar';
-import { RagService } from '../../services/rag.service';
+import { RagService, Source } from '../../services/rag.service';
 
 interface Message {
   content: string;
   isUser: boolean;
   timestamp: Date;
+  sources?: Source[];
 }
 
 @Component({
@@ -48,6 +49,16 @@ interface Message {
                         </div>
                       }
                       <p class="whitespace-pre-wrap">{{ message.content }}</p>
+                      @if (message.sources?.length) {
+                        <div class="flex flex-wrap gap-1 mt-2">
+                          @for (source of message.sources; track source) {
+                            <span class="text-xs bg-white text-gray-600 border border-gray-200 rounded px-2 py-0.5"
+                                  [title]="source.doc_id || ''">
+                              {{ sourceLabel(source) }}
+                            </span>
+                          }
+                        </div>
+                      }
                       <div [class]="message.isUser ? 'text-primary-200' : 'text-gray-500'"
                            class="text-xs mt-1">
                         {{ message.timestamp | date:'shortTime' }}
@@ -140,26 +151,48 @@ export class ChatComponent implements OnInit {
     const messageToSend = this.newMessage;
     this.newMessage = '';
 
-    // Send to backend
-    this.ragService.sendMessage(messageToSend).subscribe({
-      next: (response) => {
-        this.messages.push({
-          content: response.answer,
-          isUser: false,
-          timestamp: new Date()
-        });
+    // Stream the answer into a placeholder message as tokens arrive
+    const reply: Message = {
+      content: '',
+      isUser: false,
+      timestamp: new Date()
+    };
+    this.messages.push(reply);
+
+    this.ragService.streamMessage(messageToSend).subscribe({
+      next: (event) => {
+        if (event.type === 'sources') {
+          reply.sources = this.uniqueSources(event.data as Source[]);
+        } else if (event.type === 'token') {
+          reply.content += event.data.text;
+        } else if (event.type === 'error') {
+          reply.content = 'Sorry, I encountered an error while processing your request. Please try again.';
+          console.error('Chat error:', event.data);
+        }
       },
       error: (error) => {
-        this.messages.push({
-          content: 'Sorry, I encountered an error while processing your request. Please try again.',
-          isUser: false,
-          timestamp: new Date()
-        });
+        reply.content = 'Sorry, I encountered an error while processing your request. Please try again.';
         console.error('Chat error:', error);
       }
     });
   }
 
+  sourceLabel(source: Source): string {
+    const name = source.source || 'Unknown document';
+    return source.page ? `${name}, p. ${source.page}` : name;
+  }
+
+  // Several retrieved chunks often come from the same page; list each page once
+  private uniqueSources(sources: Source[]): Source[] {
+    const seen = new Set<string>();
+    return sources.filter(source => {
+      const key = `${source.doc_id ?? source.source}:${source.page ?? ''}`;
+      if (seen.has(key)) return false;
+      seen.add(key);
+      return true;
+    });
+  }
+
   onEnter(event: Event) {
     const keyboardEvent = event as KeyboardEvent;
     if (!keyboardEvent.shiftKey) {
@@ -1,10 +1,18 @@
-import { Component } from '@angular/core';
+import { Component, OnDestroy } from '@angular/core';
 import { CommonModule } from '@angular/common';
 import { FileUploadModule } from 'primeng/fileupload';
 import { ButtonModule } from 'primeng/button';
 import { ToastModule } from 'primeng/toast';
 import { MessageService } from 'primeng/api';
-import { RagService } from '../../services/rag.service';
+import { Subscription } from 'rxjs';
+import { Job, JobStatus, RagService } from '../../services/rag.service';
+
+interface UploadEntry {
+  filename: string;
+  status: JobStatus;
+  stage: string | null;
+  error: string | null;
+}
 
 @Component({
   selector: 'app-upload',
@@ -45,6 +53,23 @@ import { RagService } from '../../services/rag.service';
             </ng-template>
           </p-fileUpload>
 
+          @if (uploads.length) {
+            <div class="mt-8">
+              <h3 class="text-lg font-semibold text-gray-900 mb-4">Processing</h3>
+              <ul class="space-y-2">
+                @for (upload of uploads; track upload) {
+                  <li class="flex items-center justify-between text-gray-600">
+                    <span>{{ upload.filename }}</span>
+                    <span [class]="upload.status === 'failed' ? 'text-red-600' : upload.status === 'done' ? 'text-green-600' : 'text-gray-500'"
+                          [title]="upload.error || ''">
+                      {{ statusLabel(upload) }}
+                    </span>
+                  </li>
+                }
+              </ul>
+            </div>
+          }
+
           <div class="mt-8">
             <h3 class="text-lg font-semibold text-gray-900 mb-4">Upload Guidelines</h3>
             <ul class="list-disc list-inside text-gray-600 space-y-2">
@@ -60,12 +85,19 @@ import { RagService } from '../../services/rag.service';
   `,
   styles: []
 })
-export class UploadComponent {
+export class UploadComponent implements OnDestroy {
+  uploads: UploadEntry[] = [];
+  private jobWatches = new Subscription();
+
   constructor(
     private messageService: MessageService,
     private ragService: RagService
   ) {}
 
+  ngOnDestroy() {
+    this.jobWatches.unsubscribe();
+  }
+
   onUpload(event: any) {
     const files = event.files;
     console.log('Uploading files:', files); // Debug log
@@ -76,11 +108,15 @@ export class UploadComponent {
       this.ragService.uploadDocument(file).subscribe({
         next: (response) => {
           console.log('Upload response:', response); // Debug log
+          // The file is stored; extraction and indexing continue in a background job
+          const upload: UploadEntry = { filename: file.name, status: response.status, stage: null, error: null };
+          this.uploads.unshift(upload);
           this.messageService.add({
-            severity: 'success',
-            summary: 'Success',
-            detail: `${file.name} uploaded successfully`
+            severity: 'info',
+            summary: response.duplicate ? 'Already uploaded' : 'Queued',
+            detail: response.duplicate ? response.message : `${file.name} uploaded and queued for processing`
           });
+          this.watchJob(response.job_id, upload);
         },
         error: (error) => {
           console.error('Upload error:', error); // Debug log
@@ -93,4 +129,49 @@ export class UploadComponent {
       });
     });
   }
-} 
\ No newline at end of file
+
+  statusLabel(upload: UploadEntry): string {
+    switch (upload.status) {
+      case 'queued':
+        return 'Queued';
+      case 'running':
+        return upload.stage ? `Processing (${upload.stage})` : 'Processing';
+      case 'done':
+        return 'Ready';
+      case 'failed':
+        return 'Failed';
+    }
+  }
+
+  // Polls the job until it is done or failed and reports the outcome
+  private watchJob(jobId: string, upload: UploadEntry) {
+    this.jobWatches.add(this.ragService.watchJob(jobId).subscribe({
+      next: (job: Job) => {
+        upload.status = job.status;
+        upload.stage = job.stage;
+        upload.error = job.error;
+        if (job.status === 'done') {
+          this.messageService.add({
+            severity: 'success',
+            summary: 'Success',
+            detail: `${upload.filename} processed and ready for questions`
+          });
+        } else if (job.status === 'failed') {
+          this.messageService.add({
+            severity: 'error',
+            summary: 'Error',
+            detail: `Failed to process ${upload.filename}: ${job.error}`
+          });
+        }
+      },
+      error: (error) => {
+        console.error('Job status error:', error); // Debug log
+        this.messageService.add({
+          severity: 'error',
+          summary: 'Error',
+          detail: `Could not check the status of ${upload.filename}: ${error.message}`
+        });
+      }
+    }));
+  }
+}
@@ -1,11 +1,53 @@
 import { Injectable } from '@angular/core';
 import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { Observable } from 'rxjs';
-import { tap } from 'rxjs/operators';
+import { Observable, timer } from 'rxjs';
+import { switchMap, takeWhile, tap } from 'rxjs/operators';
+
+// A retrieved chunk's origin, as returned by /chat and the /chat/stream "sources" event
+export interface Source {
+  source?: string;
+  page?: number;
+  doc_id?: string;
+}
 
 export interface ChatResponse {
   answer: string;
-  sources?: string[];
+  sources?: Source[];
+  session_id?: string;
+  cached?: boolean;
+  context_tokens?: number;
+}
+
+export type JobStatus = 'queued' | 'running' | 'done' | 'failed';
+
+// /upload answers 202 once the file is stored; indexing runs as a background job
+export interface UploadResponse {
+  job_id: string;
+  filename: string;
+  collection: string;
+  status: JobStatus;
+  duplicate?: boolean;
+  message: string;
+}
+
+export interface Job {
+  job_id: string;
+  collection: string;
+  filename: string;
+  status: JobStatus;
+  stage: string | null;
+  progress: {
+    pages_total: number | null;
+    pages_extracted: number | null;
+    chunks_total: number | null;
+    chunks_embedded: number | null;
+  };
+  error: string | null;
+}
+
+export interface ChatStreamEvent {
+  type: 'session' | 'sources' | 'token' | 'done' | 'error';
+  data: any;
 }
 
 @Injectable({
@@ -13,17 +55,19 @@ export interface ChatResponse {
 })
 export class RagService {
   private apiUrl = 'http://localhost:8000';  // This will be proxied to the backend
+  // Conversation history is kept by the backend under this id
+  private sessionId: string | null = null;
 
   constructor(private http: HttpClient) {}
 
-  uploadDocument(file: File): Observable<any> {
+  uploadDocument(file: File): Observable<UploadResponse> {
     const formData = new FormData();
     formData.append('file', file);
     
     console.log('Sending request to:', `${this.apiUrl}/upload`); // Debug log
     console.log('FormData:', formData); // Debug log
     
-    return this.http.post(`${this.apiUrl}/upload`, formData).pipe(
+    return this.http.post<UploadResponse>(`${this.apiUrl}/upload`, formData).pipe(
       tap(
         response => console.log('Upload success:', response),
         error => console.error('Upload error:', error)
@@ -31,8 +75,76 @@ export class RagService {
     );
   }
 
+  getJob(jobId: string): Observable<Job> {
+    return this.http.get<Job>(`${this.apiUrl}/jobs/${jobId}`);
+  }
+
+  // Polls /jobs/{id} until the job is done or failed, emitting every update
+  // (the last emission is the finished job).
+  watchJob(jobId: string, intervalMs = 1000): Observable<Job> {
+    return timer(0, intervalMs).pipe(
+      switchMap(() => this.getJob(jobId)),
+      takeWhile(job => job.status === 'queued' || job.status === 'running', true)
+    );
+  }
+
   sendMessage(message: string): Observable<ChatResponse> {
-    return this.http.post<ChatResponse>(`${this.apiUrl}/chat`, { message });
+    return this.http.post<ChatResponse>(`${this.apiUrl}/chat`, { message, session_id: this.sessionId }).pipe(
+      tap(response => {
+        if (response.session_id) this.sessionId = response.session_id;
+      })
+    );
+  }
+
+  // Streams server-sent events from /chat/stream; unsubscribing aborts the
+  // request so the backend stops generating.
+  streamMessage(message: string): Observable<ChatStreamEvent> {
+    return new Observable<ChatStreamEvent>(subscriber => {
+      const controller = new AbortController();
+
+      fetch(`${this.apiUrl}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message, session_id: this.sessionId }),
+        signal: controller.signal
+      }).then(async response => {
+        if (!response.ok || !response.body) {
+          throw new Error(`Chat stream failed with status ${response.status}`);
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let boundary = buffer.indexOf('\n\n');
+          while (boundary !== -1) {
+            const event = this.parseSseEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (event?.type === 'session') this.sessionId = event.data.session_id;
+            if (event) subscriber.next(event);
+            boundary = buffer.indexOf('\n\n');
+          }
+        }
+        subscriber.complete();
+      }).catch(error => {
+        if (!controller.signal.aborted) subscriber.error(error);
+      });
+
+      return () => controller.abort();
+    });
+  }
+
+  private parseSseEvent(raw: string): ChatStreamEvent | null {
+    let type = 'message';
+    const data: string[] = [];
+    for (const line of raw.split('\n')) {
+      if (line.startsWith('event:')) type = line.slice(6).trim();
+      else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+    }
+    if (!data.length) return null;
+    return { type: type as ChatStreamEvent['type'], data: JSON.parse(data.join('\n')) };
   }
 
   getActiveDocuments(): Observable<string[]> {
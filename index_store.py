@@ -0,0 +1,686 @@
+# index_store.py
+"""On-disk layout of the FAISS store: a memory-mapped index plus an SQLite docstore.
+
+An index directory holds:
+
+- ``index.faiss``: the faiss index, memory-mapped read-only when served, so
+  every worker process shares the same page cache
+- ``docstore.sqlite``: chunk text and metadata keyed by chunk id, the
+  index-position to chunk-id map, and an FTS5 (BM25) full-text index kept
+  in sync by triggers; rows are read only for the top-k hits
+- ``meta.json``: format version and index type
+
+These files live in a version subdirectory (``v000001``, ``v000002``, ...)
+named by the ``CURRENT`` pointer file; directories saved before versioning
+keep them at the top level and are still read. Writers never touch a
+served version. ``load_vectorstore(..., writable=True)`` copies the
+docstore into a staging directory, ``save_vectorstore`` writes the index
+there, renames it to the next version and then atomically replaces
+``CURRENT``, so the pointer always names a complete version whatever
+point a save is interrupted at.
+
+Indexes saved by earlier versions (``index.pkl``) have to be converted once:
+
+    python index_store.py convert [faiss_index]
+"""
+
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import uuid
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from glob import glob
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within one process
+    fcntl = None
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from ann_index import index_type, rebuild_without
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+META_FILE = "meta.json"
+LEGACY_FILE = "index.pkl"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+_VERSION_DIR = re.compile(r"^v(\d{6,})$")
+
+# Rows per statement when copying or paging through the docstore
+_BATCH_ROWS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS positions_id ON positions (id);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (json_extract(metadata, '$.source'));
+CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (json_extract(metadata, '$.doc_id'));
+CREATE INDEX IF NOT EXISTS chunks_page ON chunks (json_extract(metadata, '$.page'));
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    text, content='chunks', content_rowid='rowid',
+    tokenize="unicode61 remove_diacritics 2 tokenchars '-_'"
+);
+CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+"""
+
+# Metadata fields retrieval can be restricted to; each has an index above
+FILTER_KEYS = ("source", "doc_id", "page")
+
+# Query words for the full-text index; matches the tokenizer's tokenchars
+_TERM = re.compile(r"[\w-]*\w[\w-]*")
+
+
+class LegacyIndexError(ValueError):
+    """The index directory still uses the pickled docstore format."""
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """LangChain docstore backed by an SQLite file; documents are read on demand.
+
+    One connection is shared by all threads and serialized by a lock, so a
+    store keeps working from its open file even after its directory has
+    been replaced by a newer index version.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            has_fts = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+            self._conn.executescript(_SCHEMA)
+            if not has_fts:
+                # Docstores written before the full-text index existed
+                with self._conn:
+                    self._conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+        self._lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def search(self, search):
+        rows = self._query("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        text, metadata = rows[0]
+        return Document(page_content=text, metadata=json.loads(metadata))
+
+    def add(self, texts):
+        existing = self._existing(list(texts))
+        if existing:
+            raise ValueError(f"Tried to add ids that already exist: {existing}")
+        self._write(
+            "INSERT INTO chunks (id, text, metadata) VALUES (?, ?, ?)",
+            [(id_, doc.page_content, json.dumps(doc.metadata)) for id_, doc in texts.items()]
+        )
+
+    def delete(self, ids):
+        if not self._existing(ids):
+            raise ValueError(f"Tried to delete ids that does not  exist: {ids}")
+        self._write("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+
+    def _existing(self, ids):
+        found = set()
+        for start in range(0, len(ids), _BATCH_ROWS):
+            batch = ids[start:start + _BATCH_ROWS]
+            marks = ",".join("?" * len(batch))
+            found.update(row[0] for row in self._query(f"SELECT id FROM chunks WHERE id IN ({marks})", batch))
+        return found
+
+    def ids_with_prefix(self, prefix):
+        # Range scan over the primary key; ':' sorts right after the 16 hex digits
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return [row[0] for row in self._query("SELECT id FROM chunks WHERE id >= ? AND id < ?", (prefix, upper))]
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    @staticmethod
+    def _filter_clause(filter):
+        clauses, params = [], []
+        for key, values in filter.items():
+            clauses.append(f"json_extract(metadata, '$.{key}') IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        return " AND ".join(clauses), params
+
+    def positions_matching(self, filter):
+        """Index positions of the chunks whose metadata matches every ``FILTER_KEYS`` entry."""
+        clause, params = self._filter_clause(filter)
+        rows = self._query(
+            f"SELECT position FROM positions WHERE id IN (SELECT id FROM chunks WHERE {clause})", params
+        )
+        return [row[0] for row in rows]
+
+    def keyword_positions(self, query, limit, filter=None):
+        """Index positions of the best BM25 matches for the words of ``query``, best first."""
+        terms = {term.lower() for term in _TERM.findall(query)}
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in sorted(terms))
+        sql = (
+            "SELECT p.position FROM chunks_fts "
+            "JOIN chunks c ON c.rowid = chunks_fts.rowid "
+            "JOIN positions p ON p.id = c.id "
+            "WHERE chunks_fts MATCH ?"
+        )
+        params = [match]
+        if filter:
+            clause, filter_params = self._filter_clause(filter)
+            sql += f" AND c.id IN (SELECT id FROM chunks WHERE {clause})"
+            params.extend(filter_params)
+        sql += " ORDER BY bm25(chunks_fts) LIMIT ?"
+        params.append(limit)
+        try:
+            return [row[0] for row in self._query(sql, params)]
+        except sqlite3.OperationalError as e:
+            # Read-only docstore written before the full-text index existed
+            logger.debug(f"Keyword search unavailable for {self.path}: {e}")
+            return []
+
+    def sources(self):
+        """Distinct ``source`` values with their chunk counts."""
+        return self._query(
+            "SELECT json_extract(metadata, '$.source') AS source, COUNT(*) FROM chunks "
+            "GROUP BY source ORDER BY source"
+        )
+
+    def backup_to(self, path):
+        """Copy the database to ``path`` consistently, even while it is open."""
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+
+class SQLiteIdMap(MutableMapping):
+    """``index_to_docstore_id`` kept in the docstore's ``positions`` table.
+
+    Behaves like the dict LangChain uses, but only the rows that are looked
+    up are read.
+    """
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position):
+        rows = self.docstore._query("SELECT id FROM positions WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __setitem__(self, position, id_):
+        self.update({position: id_})
+
+    def __delitem__(self, position):
+        self[position]
+        self.docstore._write("DELETE FROM positions WHERE position = ?", [(int(position),)])
+
+    def update(self, mapping=(), **kwargs):
+        items = mapping.items() if hasattr(mapping, "items") else mapping
+        self.docstore._write(
+            "INSERT OR REPLACE INTO positions (position, id) VALUES (?, ?)",
+            [(int(position), id_) for position, id_ in items]
+        )
+
+    def items(self):
+        last = -1
+        while True:
+            rows = self.docstore._query(
+                "SELECT position, id FROM positions WHERE position > ? ORDER BY position LIMIT ?",
+                (last, _BATCH_ROWS)
+            )
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def __iter__(self):
+        return (position for position, _ in self.items())
+
+    def values(self):
+        return (id_ for _, id_ in self.items())
+
+    def __len__(self):
+        return self.docstore._query("SELECT COUNT(*) FROM positions")[0][0]
+
+    def positions_of(self, ids):
+        """Map each of ``ids`` that is present to its index position."""
+        found = {}
+        for start in range(0, len(ids), _BATCH_ROWS):
+            batch = ids[start:start + _BATCH_ROWS]
+            marks = ",".join("?" * len(batch))
+            found.update(
+                (id_, position) for position, id_ in
+                self.docstore._query(f"SELECT position, id FROM positions WHERE id IN ({marks})", batch)
+            )
+        return found
+
+    def next_position(self):
+        return self.docstore._query("SELECT COALESCE(MAX(position) + 1, 0) FROM positions")[0][0]
+
+    def compact(self):
+        """Renumber positions to 0..n-1, keeping their order (as IndexFlat.remove_ids does)."""
+        with self.docstore._lock, self.docstore._conn as conn:
+            conn.execute(
+                "CREATE TEMP TABLE renumbered AS "
+                "SELECT ROW_NUMBER() OVER (ORDER BY position) - 1 AS position, id FROM positions"
+            )
+            conn.execute("DELETE FROM positions")
+            conn.execute("INSERT INTO positions SELECT position, id FROM renumbered")
+            conn.execute("DROP TABLE renumbered")
+
+
+class MappedFAISS(FAISS):
+    """LangChain FAISS store over an ``SQLiteDocstore`` and ``SQLiteIdMap``.
+
+    Adds and deletes keep the id map in SQLite instead of rebuilding a dict.
+    IVF indexes keep the ids of remaining vectors on removal, so their
+    positions may have gaps and new vectors get explicit ids after the
+    highest one; other index types compact positions the way faiss does.
+    """
+
+    def __init__(self, *args, staging_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.staging_dir = staging_dir
+
+    def _keeps_ids(self):
+        return faiss.try_extract_index_ivf(self.index) is not None
+
+    # Replaces FAISS.__add, which every add_* and from_* path goes through
+    def _FAISS__add(self, texts, embeddings, metadatas=None, ids=None):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if len(ids) != len(set(ids)):
+            raise ValueError("Duplicate ids found in the ids list.")
+        vectors = np.array(list(embeddings), dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        start = self.index_to_docstore_id.next_position()
+        positions = np.arange(start, start + len(ids), dtype=np.int64)
+        if self._keeps_ids():
+            self.index.add_with_ids(vectors, positions)
+        else:
+            self.index.add(vectors)
+        self.docstore.add({
+            id_: Document(page_content=text, metadata=metadata)
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        })
+        self.index_to_docstore_id.update(zip(positions.tolist(), ids))
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        positions = self.index_to_docstore_id.positions_of(list(ids))
+        missing_ids = set(ids).difference(positions)
+        if missing_ids:
+            raise ValueError(
+                f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}"
+            )
+        removed = np.fromiter(positions.values(), dtype=np.int64)
+        if isinstance(self.index, faiss.IndexHNSW):
+            # HNSW graphs cannot drop vectors; rebuild without them (positions are compacted below)
+            self.index = rebuild_without(self.index, removed)
+        else:
+            self.index.remove_ids(removed)
+        self.docstore.delete(list(ids))
+        self.docstore._write("DELETE FROM positions WHERE position = ?", [(p,) for p in positions.values()])
+        if not self._keeps_ids():
+            self.index_to_docstore_id.compact()
+        return True
+
+
+def normalize_filter(filter):
+    """Validate a metadata filter into ``{key: [values]}``; raises ValueError."""
+    normalized = {}
+    for key, value in (filter or {}).items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Cannot filter on {key!r}; expected one of {', '.join(FILTER_KEYS)}")
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if not values or any(isinstance(v, (dict, list)) for v in values):
+            raise ValueError(f"Invalid filter value for {key!r}")
+        normalized[key] = [int(v) for v in values] if key == "page" else [str(v) for v in values]
+    return normalized
+
+
+def filter_positions(vectorstore, filter):
+    """Index positions of the chunks of ``vectorstore`` matching a normalized ``filter``."""
+    if isinstance(vectorstore.docstore, SQLiteDocstore):
+        return vectorstore.docstore.positions_matching(filter)
+    positions = []
+    for position, id_ in vectorstore.index_to_docstore_id.items():
+        document = vectorstore.docstore.search(id_)
+        if isinstance(document, Document) and all(
+            document.metadata.get(key) in values for key, values in filter.items()
+        ):
+            positions.append(position)
+    return positions
+
+
+# Writers in this process; the file lock below covers other processes
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def write_lock(index_path):
+    """Serialise load → modify → save cycles on ``index_path`` across threads and processes.
+
+    Every server worker and ``ingest.py`` take an exclusive ``flock`` on
+    ``<index_path>/.lock``, so one writer's save never replaces a version
+    another writer has committed in the meantime.
+    """
+    with _write_lock:
+        _recover_backup(index_path)
+        os.makedirs(index_path, exist_ok=True)
+        with open(os.path.join(index_path, LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def current_version(index_path):
+    """Name of the committed version of ``index_path``, or None for an unversioned directory."""
+    try:
+        with open(os.path.join(index_path, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(index_path):
+    """Directory holding the committed index, docstore and meta of ``index_path``."""
+    version = current_version(index_path)
+    return os.path.join(index_path, version) if version else index_path
+
+
+def read_meta(index_path):
+    try:
+        with open(os.path.join(version_dir(index_path), META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _read_index(path, kind, writable):
+    if writable:
+        return faiss.read_index(path)
+    # IVF inverted lists are mapped with IO_FLAG_MMAP, flat codes with IO_FLAG_MMAP_IFC
+    if kind in ("ivf_flat", "ivf_pq"):
+        flags = faiss.IO_FLAG_MMAP
+    elif hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags = faiss.IO_FLAG_MMAP_IFC
+    else:
+        logger.warning(f"faiss {faiss.__version__} cannot memory-map flat indexes; {path} is read into memory")
+        return faiss.read_index(path)
+    try:
+        return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        logger.warning(f"Could not memory-map {path}, reading it into memory: {e}")
+        return faiss.read_index(path)
+
+
+def _recover_backup(index_path):
+    """Put back an index left renamed to ``.faiss_tmp_*.old`` by a save that crashed before versioning.
+
+    Those saves staged next to the index, so a backup can only be
+    attributed to ``index_path`` when it is the only one in the parent.
+    """
+    if os.path.exists(index_path):
+        return
+    parent = os.path.dirname(os.path.abspath(index_path))
+    backups = [path for path in glob(os.path.join(parent, ".faiss_tmp_*.old")) if read_meta(path) is not None]
+    if len(backups) == 1:
+        logger.warning(f"Restoring {index_path} from the backup {backups[0]} left by an interrupted save.")
+        os.rename(backups[0], index_path)
+    elif backups:
+        logger.error(f"{index_path} is missing and several interrupted saves left backups: {backups}; "
+                     f"rename the right one to {index_path}")
+
+
+def load_vectorstore(embedding_model, index_path, writable=False):
+    """Open the store at ``index_path``, or return None if none has been saved yet.
+
+    Read-only stores memory-map the index and never modify it; they must not
+    be added to. Writable stores work on a staging copy of the docstore that
+    ``save_vectorstore`` later commits.
+    """
+    _recover_backup(index_path)
+    meta = read_meta(index_path)
+    if meta is None:
+        if os.path.exists(os.path.join(index_path, LEGACY_FILE)):
+            raise LegacyIndexError(
+                f"{index_path} uses the old pickled format; convert it with "
+                f"'python index_store.py convert {index_path}'"
+            )
+        return None
+
+    with stage_timer("index_load"):
+        committed = version_dir(index_path)
+        index = _read_index(os.path.join(committed, INDEX_FILE), meta.get("index_type"), writable)
+        docstore_path = os.path.join(committed, DOCSTORE_FILE)
+        staging_dir = None
+        if writable:
+            staging_dir = _staging_dir(index_path)
+            source = SQLiteDocstore(docstore_path, read_only=True)
+            try:
+                source.backup_to(os.path.join(staging_dir, DOCSTORE_FILE))
+            finally:
+                source._conn.close()
+            docstore_path = os.path.join(staging_dir, DOCSTORE_FILE)
+        docstore = SQLiteDocstore(docstore_path, read_only=not writable)
+    return MappedFAISS(embedding_model, index, docstore, SQLiteIdMap(docstore), staging_dir=staging_dir)
+
+
+def _staging_dir(index_path):
+    os.makedirs(index_path, exist_ok=True)
+    return tempfile.mkdtemp(prefix=".staging_", dir=index_path)
+
+
+def _write_docstore(vectorstore, path):
+    """Copy an in-memory store's documents and id map into a new SQLite docstore."""
+    docstore = SQLiteDocstore(path)
+    id_map = SQLiteIdMap(docstore)
+    items = sorted(vectorstore.index_to_docstore_id.items())
+    for start in range(0, len(items), _BATCH_ROWS):
+        batch = items[start:start + _BATCH_ROWS]
+        documents = {id_: vectorstore.docstore.search(id_) for _, id_ in batch}
+        docstore.add({id_: doc for id_, doc in documents.items() if isinstance(doc, Document)})
+        id_map.update(batch)
+    docstore._conn.close()
+
+
+def _versions(index_path):
+    """Committed version directory names of ``index_path``, oldest first."""
+    names = [name for name in os.listdir(index_path) if _VERSION_DIR.match(name)]
+    return sorted(names, key=lambda name: int(_VERSION_DIR.match(name).group(1)))
+
+
+def _fsync_dir(path):
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _switch_version(index_path, version):
+    """Atomically point ``CURRENT`` at ``version``."""
+    pointer = os.path.join(index_path, CURRENT_FILE)
+    tmp_pointer = f"{pointer}.{uuid.uuid4().hex}"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, pointer)
+    _fsync_dir(index_path)
+
+
+def _prune(index_path, keep):
+    """Remove versions not in ``keep`` (left by older or interrupted saves) and unversioned files."""
+    for name in _versions(index_path):
+        if name not in keep:
+            shutil.rmtree(os.path.join(index_path, name), ignore_errors=True)
+    for name in (INDEX_FILE, DOCSTORE_FILE, META_FILE):
+        path = os.path.join(index_path, name)
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def save_vectorstore(vectorstore, index_path):
+    """Commit the store as a new version of ``index_path``.
+
+    The staging directory is filled and renamed to the next version, then
+    ``CURRENT`` is replaced to point at it. Until that replace the previous
+    version stays the committed one, so a failed or interrupted save loses
+    nothing but its own changes.
+    """
+    staged = isinstance(vectorstore, MappedFAISS) and vectorstore.staging_dir
+    tmp_dir = vectorstore.staging_dir if staged else _staging_dir(index_path)
+    try:
+        with stage_timer("index_save"):
+            if not staged:
+                _write_docstore(vectorstore, os.path.join(tmp_dir, DOCSTORE_FILE))
+            faiss.write_index(vectorstore.index, os.path.join(tmp_dir, INDEX_FILE))
+        with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"format": FORMAT_VERSION, "index_type": index_type(vectorstore.index)}, f)
+        previous = current_version(index_path)
+        versions = _versions(index_path)
+        number = int(_VERSION_DIR.match(versions[-1]).group(1)) + 1 if versions else 1
+        version = f"v{number:06d}"
+        os.rename(tmp_dir, os.path.join(index_path, version))
+        tmp_dir = None
+        _switch_version(index_path, version)
+    except Exception:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        if staged:
+            # Further changes need a fresh staging copy
+            vectorstore.staging_dir = None
+    # Other workers may still be serving the previous version until they reload
+    _prune(index_path, keep=(previous, version))
+    return version
+
+
+def discard(vectorstore):
+    """Drop the uncommitted changes of a writable store."""
+    staging_dir = getattr(vectorstore, "staging_dir", None)
+    if staging_dir:
+        vectorstore.docstore._conn.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        vectorstore.staging_dir = None
+
+
+def create_vectorstore(embedding_model, dim, index_path):
+    """Empty writable store of dimension ``dim``, to be saved to ``index_path``."""
+    staging_dir = _staging_dir(index_path)
+    docstore = SQLiteDocstore(os.path.join(staging_dir, DOCSTORE_FILE))
+    return MappedFAISS(
+        embedding_model, faiss.IndexFlatL2(dim), docstore, SQLiteIdMap(docstore), staging_dir=staging_dir
+    )
+
+
+class _PickledObject:
+    """Stands in for the LangChain classes of a pickled docstore, keeping only their state."""
+
+    def __setstate__(self, state):
+        self.state = state
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    # The pickle names LangChain classes of whatever version wrote it, pydantic
+    # v1 or v2 based; rebuilding them from their raw state works with either
+    def find_class(self, module, name):
+        if module.startswith("langchain"):
+            return type(name, (_PickledObject,), {})
+        return super().find_class(module, name)
+
+
+def _pickled_fields(obj):
+    state = obj.state
+    if isinstance(state, tuple):
+        state = state[0]
+    return state.get("__dict__", state)
+
+
+def _load_legacy(index_path):
+    with open(os.path.join(index_path, LEGACY_FILE), "rb") as f:
+        pickled_docstore, index_to_docstore_id = _LegacyUnpickler(f).load()
+    documents = {}
+    for id_, pickled in _pickled_fields(pickled_docstore)["_dict"].items():
+        fields = _pickled_fields(pickled)
+        documents[id_] = Document(page_content=fields["page_content"], metadata=fields.get("metadata") or {})
+    index = faiss.read_index(os.path.join(index_path, INDEX_FILE))
+    return FAISS(None, index, InMemoryDocstore(documents), index_to_docstore_id)
+
+
+def convert_legacy(index_path):
+    """Rewrite an ``index.faiss`` + ``index.pkl`` directory in the current format.
+
+    This is the only place that still unpickles a docstore, so run it only
+    on indexes you created yourself.
+    """
+    if read_meta(index_path) is not None:
+        logger.info(f"{index_path} is already in the current format.")
+        return
+    vectorstore = _load_legacy(index_path)
+    save_vectorstore(vectorstore, index_path)
+    os.unlink(os.path.join(index_path, LEGACY_FILE))
+    logger.info(f"Converted {index_path} ({vectorstore.index.ntotal} vectors).")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "convert":
+        raise SystemExit("Usage: python index_store.py convert [index_path ...]")
+    for path in sys.argv[2:] or ["faiss_index"]:
+        convert_legacy(path)
@@ -0,0 +1,216 @@
+# ingest.py
+"""Bulk ingestion of a folder of PDFs into the FAISS index.
+
+PDFs are extracted concurrently in a process pool. Each document is split
+page by page into chunks that carry their own ``source``, ``page`` and
+``doc_id`` metadata. The chunks flow through a bounded queue to a single
+consumer thread, which embeds them in fixed-size batches and appends them to
+the index. The queue and the number of documents in flight are both capped,
+so the pipeline holds only a few documents' text and one batch of vectors
+in memory at any time, however large the folder is.
+
+Usage: python ingest.py <folder> [--index-path faiss_index] [--workers N]
+                        [--batch-size 64] [--queue-size 512] [--rebuild]
+"""
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from langchain.schema import Document
+
+import extract_text
+from ann_index import INDEX_TYPE, convert, index_type
+from index_store import create_vectorstore, discard
+from embeding import (
+    INDEX_PATH,
+    MIN_CHUNK_LENGTH,
+    create_embeddings,
+    document_id,
+    ids_for_document,
+    index_write_lock,
+    load_vectorstore,
+    save_vectorstore,
+    split_pages
+)
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.environ.get("RAG_INGEST_BATCH_SIZE", "64"))
+INGEST_QUEUE_SIZE = int(os.environ.get("RAG_INGEST_QUEUE_SIZE", "512"))
+
+# Marks the end of the chunk stream for the consumer thread
+_DONE = object()
+
+
+def _extract_document(pdf_path):
+    """Process-pool task: return the text of every page of one PDF, read as /upload reads it."""
+    return extract_text.extract_page_texts(pdf_path, workers=1)
+
+
+def document_chunks(pdf_path, pages):
+    """Yield one Document per chunk of ``pages`` with per-document ids and page metadata."""
+    source = os.path.basename(pdf_path)
+    doc_id = document_id(source)
+    chunk_num = 0
+    for page_number, chunk in split_pages(pages):
+        if len(chunk.strip()) < MIN_CHUNK_LENGTH:
+            continue
+        metadata = {"source": source, "page": page_number, "doc_id": doc_id, "chunk": chunk_num}
+        yield f"{doc_id}:{chunk_num}", Document(page_content=chunk, metadata=metadata)
+        chunk_num += 1
+
+
+class _IndexAppender:
+    """Consumer side of the pipeline: embeds queued chunks in batches and appends them."""
+
+    def __init__(self, embedding_model, faiss_db, batch_size, index_path):
+        self.embedding_model = embedding_model
+        self.faiss_db = faiss_db
+        self.index_path = index_path
+        self.batch_size = batch_size
+        self.chunks = 0
+        self.error = None
+        self._seen_docs = set()
+
+    def run(self, chunk_queue):
+        batch = []
+        try:
+            while True:
+                item = chunk_queue.get()
+                if item is _DONE:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._append(batch)
+                    batch = []
+            if batch:
+                self._append(batch)
+        except Exception as e:
+            self.error = e
+            logger.error(f"Failed to append chunks to the index: {e}")
+            # Keep draining so the producer never blocks on a full queue
+            while chunk_queue.get() is not _DONE:
+                pass
+
+    def _append(self, batch):
+        ids = [chunk_id for chunk_id, _ in batch]
+        texts = [document.page_content for _, document in batch]
+        metadatas = [document.metadata for _, document in batch]
+        vectors = self.embedding_model.embed_documents(texts)
+
+        if self.faiss_db is None:
+            self.faiss_db = create_vectorstore(self.embedding_model, len(vectors[0]), self.index_path)
+        else:
+            self._drop_stale(metadatas)
+        self.faiss_db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        self._seen_docs.update(metadata["doc_id"] for metadata in metadatas)
+        self.chunks += len(batch)
+
+    def _drop_stale(self, metadatas):
+        """Remove vectors left by an earlier ingestion of a document seen for the first time."""
+        new_docs = {metadata["doc_id"] for metadata in metadatas} - self._seen_docs
+        if not new_docs:
+            return
+        stale_ids = [chunk_id for doc_id in new_docs for chunk_id in ids_for_document(self.faiss_db, doc_id)]
+        if stale_ids:
+            self.faiss_db.delete(stale_ids)
+
+
+def ingest_folder(folder_path, index_path=INDEX_PATH, workers=None, batch_size=INGEST_BATCH_SIZE,
+                  queue_size=INGEST_QUEUE_SIZE, rebuild=False, embedding_model=None):
+    """Ingest every PDF in ``folder_path`` into the index at ``index_path``.
+
+    Returns the updated vector store, or None if nothing was indexed.
+    """
+    workers = workers or os.cpu_count() or 1
+    embedding_model = embedding_model or create_embeddings(None)
+    if embedding_model is None:
+        return None
+
+    started = time.perf_counter()
+    documents = 0
+    chunk_queue = queue.Queue(maxsize=queue_size)
+
+    with index_write_lock(index_path):
+        faiss_db = None if rebuild else load_vectorstore(embedding_model, index_path, writable=True)
+        appender = _IndexAppender(embedding_model, faiss_db, batch_size, index_path)
+        consumer = threading.Thread(target=appender.run, args=(chunk_queue,), daemon=True)
+        consumer.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = {}
+                pdf_paths = extract_text.iter_pdf_files(folder_path)
+                while appender.error is None:
+                    # Keep a bounded number of documents in flight
+                    while len(pending) < workers * 2:
+                        pdf_path = next(pdf_paths, None)
+                        if pdf_path is None:
+                            break
+                        pending[executor.submit(_extract_document, pdf_path)] = pdf_path
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pdf_path = pending.pop(future)
+                        try:
+                            pages = future.result()
+                        except Exception as e:
+                            logger.error(f"Failed to process {pdf_path}: {e}")
+                            continue
+                        for item in document_chunks(pdf_path, pages):
+                            chunk_queue.put(item)
+                        documents += 1
+                        logger.info(f"Queued chunks of {pdf_path}.")
+        finally:
+            chunk_queue.put(_DONE)
+            consumer.join()
+
+        if appender.error is not None or appender.faiss_db is None:
+            if appender.faiss_db is not None:
+                discard(appender.faiss_db)
+            return None
+        if INDEX_TYPE != "flat" and index_type(appender.faiss_db.index) == "flat":
+            # Stores are built flat; train the configured type once the corpus is in
+            convert(appender.faiss_db, INDEX_TYPE)
+        save_vectorstore(appender.faiss_db, index_path)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Ingested {documents} documents, {appender.chunks} chunks in {elapsed:.1f}s "
+        f"({appender.chunks / max(elapsed, 1e-9):.1f} chunks/s); "
+        f"index has {appender.faiss_db.index.ntotal} vectors."
+    )
+    return appender.faiss_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a folder of PDFs into the FAISS index.")
+    parser.add_argument("folder")
+    parser.add_argument("--index-path", default=INDEX_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--queue-size", type=int, default=INGEST_QUEUE_SIZE)
+    parser.add_argument("--rebuild", action="store_true", help="discard the existing index first")
+    args = parser.parse_args()
+
+    vectorstore = ingest_folder(
+        args.folder,
+        index_path=args.index_path,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        rebuild=args.rebuild
+    )
+    if vectorstore is None:
+        logger.error("Nothing was ingested.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
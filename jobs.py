@@ -0,0 +1,367 @@
+# jobs.py
+"""Background ingestion of uploaded PDFs.
+
+``/upload`` only stores the file and records a job; worker threads pick
+jobs up from a small SQLite job store and run them through four stages:
+
+- ``extracted``: page texts written to ``<job dir>/pages.json``
+- ``chunked``: chunks with their metadata written to ``chunks.json``
+- ``embedded``: chunk vectors written batch by batch to ``vectors-*.npy``
+- ``indexed``: vectors committed to the collection's index shard and the
+  shard reloaded
+
+Each stage's output is checkpointed before the job's stage is advanced, so
+a job interrupted by a crash or restart resumes after its last completed
+stage (and after its last embedded batch) instead of starting over.
+Committing to the index replaces the document's earlier vectors, so
+repeating that stage is harmless. The job directory is removed once the
+job is done or has failed.
+
+Every server worker process runs its own ``JobRunner`` on the shared job
+store. A claimed job records its owner (host, pid and a per-runner token)
+and the owner refreshes a heartbeat while it runs; a running job is only
+taken over once its heartbeat is older than ``JOB_STALE_AFTER`` seconds,
+or at once if its owner was a process on this host that no longer exists.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+
+from embeding import create_page_documents, store_embeddings
+from extract_text import extract_page_texts
+from metrics import trace_id
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB = os.environ.get("RAG_JOBS_DB", "jobs.sqlite")
+JOBS_DIR = os.environ.get("RAG_JOBS_DIR", "jobs")
+JOB_WORKERS = int(os.environ.get("RAG_JOB_WORKERS", "1"))
+# Chunks embedded between two checkpoints
+JOB_EMBED_BATCH = int(os.environ.get("RAG_JOB_EMBED_BATCH", "64"))
+# Seconds between heartbeats of running jobs, and without one before another worker takes a job over
+JOB_HEARTBEAT = float(os.environ.get("RAG_JOB_HEARTBEAT", "10"))
+JOB_STALE_AFTER = float(os.environ.get("RAG_JOB_STALE_AFTER", "60"))
+
+STAGES = ("extracted", "chunked", "embedded", "indexed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    pages_total INTEGER NOT NULL DEFAULT 0,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    chunks_total INTEGER NOT NULL DEFAULT 0,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,
+    owner_host TEXT,
+    owner_pid INTEGER,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+# Columns added after the first release, for job stores created before them
+_ADDED_COLUMNS = {"owner": "TEXT", "owner_host": "TEXT", "owner_pid": "INTEGER", "heartbeat": "REAL"}
+
+
+def _process_alive(pid):
+    if os.name != "posix":
+        # Signal 0 only probes on POSIX; elsewhere rely on the heartbeat timeout
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        pass
+    return True
+
+
+class JobStore:
+    """Persistent job records: ``queued`` → ``running`` → ``done`` or ``failed``."""
+
+    def __init__(self, path=JOBS_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+
+    def create(self, collection, filename, path):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, collection, filename, path, status, created, updated) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, collection, filename, path, now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, owner):
+        """Mark the oldest queued job as running for ``owner`` and return it, or None.
+
+        Running jobs whose heartbeat is older than ``JOB_STALE_AFTER`` count
+        as queued: their owner has died or hung.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ?, "
+                "owner = ?, owner_host = ?, owner_pid = ?, heartbeat = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND COALESCE(heartbeat, 0) < ?) ORDER BY created LIMIT 1) "
+                "RETURNING *",
+                (now, owner, socket.gethostname(), os.getpid(), now, now - JOB_STALE_AFTER)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def heartbeat(self, owner):
+        """Refresh the heartbeat of the jobs ``owner`` is running."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'", (time.time(), owner)
+            )
+
+    def requeue_orphaned(self):
+        """Queue again the running jobs of processes on this host that no longer exist.
+
+        Jobs of live processes, or of other hosts, are left to their owner
+        or to the heartbeat timeout in ``claim``.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner_pid FROM jobs WHERE status = 'running' AND owner_host = ?",
+                (socket.gethostname(),)
+            ).fetchall()
+            orphaned = [row["id"] for row in rows if row["owner_pid"] is None or not _process_alive(row["owner_pid"])]
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'queued', owner = NULL, updated = ? WHERE id = ? AND status = 'running'",
+                [(time.time(), job_id) for job_id in orphaned]
+            )
+        return len(orphaned)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def describe_job(job):
+    """Public view of a job record for the status API."""
+    return {
+        "job_id": job["id"],
+        "collection": job["collection"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": {
+            "pages_total": job["pages_total"],
+            "pages_extracted": job["pages_done"],
+            "chunks_total": job["chunks_total"],
+            "chunks_embedded": job["chunks_done"],
+        },
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "created": job["created"],
+        "updated": job["updated"],
+    }
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class JobRunner:
+    """Worker threads that run queued ingestion jobs against the shared registry."""
+
+    def __init__(self, registry, store=None, workers=JOB_WORKERS, work_dir=JOBS_DIR, embed_batch=JOB_EMBED_BATCH):
+        self.registry = registry
+        self.store = store
+        self.workers = workers
+        self.work_dir = work_dir
+        self.embed_batch = embed_batch
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self):
+        if self.store is None:
+            self.store = JobStore()
+        os.makedirs(self.work_dir, exist_ok=True)
+        resumed = self.store.requeue_orphaned()
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted ingestion jobs.")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._beat, name="ingest-job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        """Stop taking new jobs; a job in progress resumes on the next start."""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, collection, filename, path):
+        job_id = self.store.create(collection, filename, path)
+        self._wakeup.set()
+        logger.info(f"Queued ingestion job {job_id} for {filename} ({collection}).")
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def stats(self):
+        return self.store.counts() if self.store is not None else {}
+
+    def _beat(self):
+        while not self._stopping.wait(JOB_HEARTBEAT):
+            try:
+                self.store.heartbeat(self.owner)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to record the heartbeat of running jobs: {e}")
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.store.claim(self.owner)
+            if job is None:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            # Log lines of the job carry its id
+            trace_id.set(job["id"][:16])
+            try:
+                self.run(job)
+                self.store.update(job["id"], status="done", error=None)
+                shutil.rmtree(self._job_dir(job), ignore_errors=True)
+                logger.info(f"Ingestion job {job['id']} done.")
+            except Exception as e:
+                if self._stopping.is_set():
+                    # Interrupted by shutdown; picked up again on the next start
+                    self.store.update(job["id"], status="queued", owner=None)
+                    continue
+                logger.error(f"Ingestion job {job['id']} failed at stage {job['stage']}: {e}")
+                self.store.update(job["id"], status="failed", error=str(e))
+                shutil.rmtree(self._job_dir(job), ignore_errors=True)
+
+    def _job_dir(self, job):
+        return os.path.join(self.work_dir, job["id"])
+
+    def _advance(self, job, stage, **fields):
+        self.store.update(job["id"], stage=stage, **fields)
+        job["stage"] = stage
+
+    def _done(self, job, stage):
+        return job["stage"] is not None and STAGES.index(job["stage"]) >= STAGES.index(stage)
+
+    def run(self, job):
+        """Run ``job`` from the stage after its last checkpoint."""
+        job_dir = self._job_dir(job)
+        os.makedirs(job_dir, exist_ok=True)
+        pages_path = os.path.join(job_dir, "pages.json")
+        chunks_path = os.path.join(job_dir, "chunks.json")
+
+        if not self._done(job, "extracted"):
+            def progress(done, total):
+                self.store.update(job["id"], pages_done=done, pages_total=total)
+
+            pages = extract_page_texts(job["path"], progress=progress)
+            if not any(pages):
+                raise ValueError("Failed to extract text from the file")
+            _write_json(pages_path, pages)
+            self._advance(job, "extracted", pages_total=len(pages), pages_done=len(pages))
+
+        if not self._done(job, "chunked"):
+            documents = create_page_documents(_read_json(pages_path), source=job["filename"])
+            if not documents:
+                raise ValueError("Failed to create document objects")
+            _write_json(chunks_path, [[document.page_content, document.metadata] for document in documents])
+            self._advance(job, "chunked", chunks_total=len(documents))
+
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in _read_json(chunks_path)]
+        if not self._done(job, "embedded"):
+            self._embed(job, documents)
+            self._advance(job, "embedded", chunks_done=len(documents))
+        vectors = self._load_vectors(job_dir)
+
+        if not self._done(job, "indexed"):
+            collection = job["collection"]
+            index_path = self.registry.path_for(collection)
+            if not store_embeddings(documents, self.registry.embeddings, index_path=index_path, vectors=vectors):
+                raise RuntimeError("Failed to store embeddings")
+            if not self.registry.reload(collection):
+                raise RuntimeError("Failed to load the updated index")
+            self._advance(job, "indexed")
+
+    def _embed(self, job, documents):
+        """Embed ``documents`` in batches, checkpointing each batch; resumes after the last one saved."""
+        job_dir = self._job_dir(job)
+        done = sum(len(batch) for batch in self._vector_batches(job_dir))
+        for start in range(done, len(documents), self.embed_batch):
+            if self._stopping.is_set():
+                raise RuntimeError("Worker stopped")
+            batch = documents[start:start + self.embed_batch]
+            vectors = self.registry.embeddings.embed_documents([document.page_content for document in batch])
+            path = os.path.join(job_dir, f"vectors-{start:08d}.npy")
+            tmp_path = f"{path}.tmp.npy"
+            np.save(tmp_path, np.asarray(vectors, dtype=np.float32))
+            os.replace(tmp_path, path)
+            self.store.update(job["id"], chunks_done=start + len(batch))
+
+    @staticmethod
+    def _vector_batches(job_dir):
+        return [np.load(path) for path in sorted(glob.glob(os.path.join(job_dir, "vectors-*[0-9].npy")))]
+
+    def _load_vectors(self, job_dir):
+        return [vector.tolist() for batch in self._vector_batches(job_dir) for vector in batch]
@@ -0,0 +1,264 @@
+# metrics.py
+"""Process-wide pipeline metrics in the Prometheus text format, and request trace ids.
+
+Instrumented code records into the module-level metrics below, for example::
+
+    with stage_timer("extract"):
+        ...
+    PAGES.inc(len(pages))
+
+``render()`` produces the ``/metrics`` payload. Values owned by other
+components (index size, cache hit counters) are registered with
+``register_collector`` and read at scrape time. Throughputs such as
+pages/s are ``rate()`` of the ``*_total`` counters.
+
+``trace_id`` holds the id of the request being served; ``TraceIdFilter``
+adds it to log records so slow requests can be followed through the logs.
+"""
+
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from tokens import estimate_tokens
+
+# Prefix trace ids to log lines
+LOG_TRACE_IDS = os.environ.get("RAG_LOG_TRACE_IDS", "1") == "1"
+
+# Seconds; covers a query embedding (ms) up to OCR of a large PDF (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+_metrics = []
+_collectors = []
+
+
+def register_collector(name, help, kind, collect, labels=()):
+    """Expose a value read at scrape time.
+
+    ``collect()`` returns a number, or a dict mapping label-value tuples to
+    numbers, or None to skip the metric.
+    """
+    _collectors.append((name, help, kind, tuple(labels), collect))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, help, kind, labels, collect in _collectors:
+        try:
+            values = collect()
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Metric {name} could not be collected: {e}")
+            continue
+        if values is None:
+            continue
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+        for key, value in sorted(values.items()):
+            lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each pipeline stage.",
+    labels=("stage",)
+)
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stage runs that raised.", labels=("stage",))
+PAGES = Counter("rag_pages_extracted_total", "PDF pages extracted.")
+CHUNKS = Counter("rag_chunks_total", "Chunks produced by the text splitter.")
+VECTORS = Counter("rag_vectors_embedded_total", "Texts embedded by the embedding model.", labels=("kind",))
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "LLM tokens, as reported by Ollama or estimated when it does not report them.",
+    labels=("type",)
+)
+LLM_FIRST_TOKEN = Histogram(
+    "rag_llm_time_to_first_token_seconds",
+    "Time from sending a prompt to the LLM until its first streamed token."
+)
+REQUESTS = Histogram(
+    "rag_http_request_duration_seconds",
+    "HTTP request latency until the response starts.",
+    labels=("method", "path", "status")
+)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Record the duration of the enclosed block in ``rag_stage_duration_seconds``."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """LangChain callback recording LLM latency, time to first token and token counts.
+
+    Ollama reports ``prompt_eval_count`` and ``eval_count`` with the final
+    generation; when they are missing the counts are estimated from text.
+    """
+
+    # Called on the caller's thread; recording is cheap
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self._lock:
+            self._runs[run_id] = [time.perf_counter(), False, sum(estimate_tokens(prompt) for prompt in prompts)]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[1]:
+                return
+            run[1] = True
+        LLM_FIRST_TOKEN.observe(time.perf_counter() - run[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        STAGE_SECONDS.observe(time.perf_counter() - run[0], stage="llm")
+        prompt_tokens, completion_tokens = 0, 0
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                prompt_tokens += info.get("prompt_eval_count") or 0
+                completion_tokens += info.get("eval_count") or estimate_tokens(generation.text)
+        LLM_TOKENS.inc(prompt_tokens or run[2], type="prompt")
+        LLM_TOKENS.inc(completion_tokens, type="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            STAGE_ERRORS.inc(stage="llm")
+            STAGE_SECONDS.observe(time.perf_counter() - run[0], stage="llm")
+
+
+# Id of the request being served, "-" outside of requests
+trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds ``trace_id`` to every log record passing through a handler."""
+
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def install_trace_logging():
+    """Prefix the messages of the root handlers' log lines with the current trace id."""
+    if not LOG_TRACE_IDS:
+        return
+    for handler in logging.getLogger().handlers:
+        if any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            continue
+        handler.addFilter(TraceIdFilter())
+        fmt = handler.formatter._fmt if handler.formatter else logging.BASIC_FORMAT
+        handler.setFormatter(logging.Formatter(fmt.replace("%(message)s", "[%(trace_id)s] %(message)s")))
@@ -0,0 +1,221 @@
+# registry.py
+
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from index_store import current_version, read_meta
+from metrics import stage_timer
+from retrieval import make_retriever
+from embeding import (
+    DEFAULT_COLLECTION,
+    INDEX_PATH,
+    collection_path,
+    list_collections,
+    create_embeddings,
+    load_vectorstore,
+    load_local_llm,
+    llm_settings,
+    create_qa_chain
+)
+
+logger = logging.getLogger(__name__)
+
+# Run a query embedding and a search at startup, before reporting ready
+WARMUP = os.environ.get("RAG_WARMUP", "1") == "1"
+# Seconds between checks for shard versions committed by other worker processes
+INDEX_RELOAD_INTERVAL = float(os.environ.get("RAG_INDEX_RELOAD_INTERVAL", "2"))
+
+
+class ReadWriteLock:
+    """Many concurrent readers or a single writer; waiting writers block new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ResourceRegistry:
+    """Process-wide models and vector stores, created once and shared by all requests.
+
+    The embedding model and the Ollama client never change after ``start()``.
+    Each collection has its own index shard; a shard's FAISS store and the
+    retrieval chain built on it are swapped together whenever ingestion
+    commits a new version of that shard. Shards other than the default one
+    are opened on first use. Versions committed by other processes (other
+    server workers, ``ingest.py``) are noticed by ``snapshot()``, which
+    compares the shard's ``CURRENT`` pointer with the loaded version at
+    most every ``INDEX_RELOAD_INTERVAL`` seconds.
+
+    ``started`` is set once ``start()`` has returned; ``ready`` additionally
+    requires the embedding model, without which no request can be served.
+    """
+
+    def __init__(self, index_path=INDEX_PATH):
+        self.index_path = index_path
+        self.embeddings = None
+        self.llm = None
+        self.llm_signature = ()
+        self._collections = {}
+        self._versions = itertools.count(1)
+        self._lock = ReadWriteLock()
+        # Committed version name each loaded shard was opened at, and when it was last compared
+        self._loaded_versions = {}
+        self._checked = {}
+        self._check_lock = threading.Lock()
+        self.started = threading.Event()
+        self.startup_seconds = None
+
+    def start(self, warm_up=WARMUP):
+        started = time.perf_counter()
+        self.embeddings = create_embeddings()
+        self.llm = load_local_llm()
+        if self.llm:
+            self.llm_signature = llm_settings(self.llm)
+        self.reload()
+        if warm_up:
+            self.warm_up()
+        self.startup_seconds = time.perf_counter() - started
+        self.started.set()
+        logger.info(f"Resources ready in {self.startup_seconds:.1f}s.")
+
+    @property
+    def ready(self):
+        return self.started.is_set() and self.embeddings is not None
+
+    def warm_up(self):
+        """Embed a dummy query and search the default shard once.
+
+        The first forward pass of the embedding model and the first search
+        of a memory-mapped index are much slower than later ones; paying for
+        them here keeps them out of the first user request.
+        """
+        if self.embeddings is None:
+            return
+        vectorstore, _, _ = self.snapshot()
+        try:
+            with stage_timer("warm_up"):
+                if vectorstore is not None:
+                    make_retriever(vectorstore).invoke("warm up")
+                else:
+                    self.embeddings.embed_query("warm up")
+        except Exception as e:
+            logger.warning(f"Warm-up failed: {e}")
+
+    def path_for(self, collection=DEFAULT_COLLECTION):
+        if collection == DEFAULT_COLLECTION:
+            return self.index_path
+        return collection_path(collection)
+
+    def reload(self, collection=DEFAULT_COLLECTION):
+        """Open the committed shard of ``collection`` read-only (memory-mapped) and publish it."""
+        index_path = self.path_for(collection)
+        committed = current_version(index_path)
+        try:
+            vectorstore = load_vectorstore(self.embeddings, index_path)
+        except Exception as e:
+            logger.error(f"Failed to load FAISS index from {index_path}: {e}")
+            return None
+        if vectorstore is not None:
+            self.swap_vectorstore(vectorstore, collection)
+            self._loaded_versions[collection] = committed
+        return vectorstore
+
+    def _reload_if_committed(self, collection):
+        """Reload ``collection`` if another process has committed a newer version of it."""
+        now = time.monotonic()
+        if now - self._checked.get(collection, 0) < INDEX_RELOAD_INTERVAL:
+            return
+        # One caller checks; the others keep serving what is loaded
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked[collection] = now
+            committed = current_version(self.path_for(collection))
+            if committed is not None and committed != self._loaded_versions.get(collection):
+                logger.info(f"Collection {collection} has a new committed version {committed}; reloading.")
+                self.reload(collection)
+        finally:
+            self._check_lock.release()
+
+    def swap_vectorstore(self, vectorstore, collection=DEFAULT_COLLECTION):
+        """Publish a newly committed shard; in-flight requests keep their snapshot."""
+        qa_chain = create_qa_chain(self.llm, vectorstore) if self.llm else None
+        with self._lock.write():
+            version = next(self._versions)
+            self._collections[collection] = (vectorstore, qa_chain, version)
+        logger.info(f"Collection {collection} swapped to version {version}.")
+
+    def embedding_stats(self):
+        """Batching statistics of the embedding service plus embedding cache counters."""
+        if self.embeddings is None:
+            return {}
+        stats = self.embeddings.model.stats()
+        stats["cache_hits"] = self.embeddings.cache.hits
+        stats["cache_misses"] = self.embeddings.cache.misses
+        return stats
+
+    def answer_scope(self, version):
+        """Cache scope for answers produced from shard ``version`` by the current LLM.
+
+        Versions are unique across collections, so the scope also tells
+        collections apart.
+        """
+        return (version, self.llm_signature)
+
+    def snapshot(self, collection=DEFAULT_COLLECTION):
+        """Return a consistent ``(vectorstore, qa_chain, version)`` triple for ``collection``."""
+        self._reload_if_committed(collection)
+        with self._lock.read():
+            entry = self._collections.get(collection)
+        if entry is None and collection != DEFAULT_COLLECTION:
+            self.reload(collection)
+            with self._lock.read():
+                entry = self._collections.get(collection)
+        return entry or (None, None, 0)
+
+    def index_sizes(self):
+        """Vectors in each loaded collection's shard."""
+        with self._lock.read():
+            return {(name,): entry[0].index.ntotal for name, entry in self._collections.items()}
+
+    def collections(self):
+        """Names of the collections that have a committed shard on disk."""
+        names = list_collections()
+        if read_meta(self.index_path) is not None:
+            names.insert(0, DEFAULT_COLLECTION)
+        return names
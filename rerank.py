@@ -0,0 +1,77 @@
+# rerank.py
+
+import logging
+import os
+import threading
+import time
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Cross-encoder used to rerank fused candidates; empty disables reranking
+RERANK_MODEL = os.environ.get("RAG_RERANK_MODEL", "")
+# Fused candidates scored by the cross-encoder
+RERANK_CANDIDATES = int(os.environ.get("RAG_RERANK_CANDIDATES", "16"))
+# Time allowed for scoring; candidates not reached in time keep their fused order
+RERANK_BUDGET_MS = float(os.environ.get("RAG_RERANK_BUDGET_MS", "150"))
+RERANK_BATCH_SIZE = int(os.environ.get("RAG_RERANK_BATCH_SIZE", "8"))
+
+
+class CrossEncoderReranker:
+    """CPU cross-encoder that reorders retrieval candidates under a latency budget.
+
+    Candidates are scored in small batches in their incoming order. Once
+    ``budget_ms`` is spent, the remaining candidates are not scored and
+    follow the scored ones in their original order, so a slow machine
+    degrades to the fused ranking instead of slowing every answer down.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.calls = 0
+        self.truncated = 0
+
+    def rerank(self, query, documents, k):
+        started = time.perf_counter()
+        scored = []
+        for start in range(0, len(documents), self.batch_size):
+            batch = documents[start:start + self.batch_size]
+            scores = self.model.predict([(query, document.page_content) for document in batch])
+            scored.extend(zip(scores, batch))
+            if (time.perf_counter() - started) * 1000 >= self.budget_ms:
+                break
+        self.calls += 1
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="rerank")
+        if len(scored) < len(documents):
+            self.truncated += 1
+        ranked = [document for _, document in sorted(scored, key=lambda item: -item[0])]
+        return (ranked + documents[len(scored):])[:k]
+
+    def stats(self):
+        return {"calls": self.calls, "over_budget": self.truncated, "budget_ms": self.budget_ms}
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+_reranker_failed = False
+
+
+def get_reranker():
+    """The process-wide reranker, or None if reranking is disabled or unavailable."""
+    global _reranker, _reranker_failed
+    if not RERANK_MODEL or _reranker_failed:
+        return None
+    with _reranker_lock:
+        if _reranker is None and not _reranker_failed:
+            try:
+                _reranker = CrossEncoderReranker()
+                logger.info(f"Cross-encoder reranker {RERANK_MODEL} loaded.")
+            except Exception as e:
+                _reranker_failed = True
+                logger.error(f"Reranking disabled, failed to load {RERANK_MODEL}: {e}")
+        return _reranker
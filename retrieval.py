@@ -0,0 +1,115 @@
+# retrieval.py
+
+import os
+
+import faiss
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores import FAISS
+
+from ann_index import search_parameters
+from context import CONTEXT_TOKEN_BUDGET, pack_context
+from index_store import SQLiteDocstore, filter_positions
+from metrics import stage_timer
+from rerank import RERANK_CANDIDATES, get_reranker
+
+# Chunks retrieved per question before context packing
+RETRIEVAL_K = int(os.environ.get("RAG_RETRIEVAL_K", "6"))
+# Fuse BM25 keyword matches with the vector search results
+HYBRID_SEARCH = os.environ.get("RAG_HYBRID_SEARCH", "1") == "1"
+# Candidates taken from each of the two result lists before fusion
+FETCH_K = int(os.environ.get("RAG_FETCH_K", "20"))
+# Reciprocal-rank fusion constant; larger values flatten the rank weights
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked lists of ids into one, scoring each id by sum(1 / (k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])
+
+
+class FAISSSearchRetriever(BaseRetriever):
+    """Hybrid retriever over a LangChain FAISS store with per-query search parameters.
+
+    ``nprobe`` (IVF indexes) and ``ef_search`` (HNSW) are passed to faiss with
+    each search instead of being set on the shared index, so requests with
+    different settings can run concurrently. Unset values fall back to
+    RAG_NPROBE / RAG_EF_SEARCH, then to the index's own defaults.
+
+    ``filter`` (normalized by ``index_store.normalize_filter``) restricts the
+    search itself to matching chunks through a faiss ID selector, so the
+    top ``k`` are always taken from the matching chunks only.
+
+    With ``hybrid`` set and an SQLite docstore, the vector results are fused
+    with BM25 matches from the docstore's full-text index, which catches
+    exact identifiers and table cells the embedding model misses. If a
+    cross-encoder is configured (RAG_RERANK_MODEL), the best fused
+    candidates are reranked before the top ``k`` are kept.
+
+    Finally the chunks are packed into at most ``token_budget`` tokens of
+    context (see ``context.pack_context``); 0 returns them unpacked.
+    """
+
+    vectorstore: FAISS
+    k: int = RETRIEVAL_K
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    nprobe: int | None = None
+    ef_search: int | None = None
+    filter: dict | None = None
+    hybrid: bool = HYBRID_SEARCH
+    fetch_k: int = FETCH_K
+    rerank: bool = True
+
+    def _dense_positions(self, query, limit):
+        store = self.vectorstore
+        selector = None
+        if self.filter:
+            allowed = filter_positions(store, self.filter)
+            if not allowed:
+                return []
+            selector = faiss.IDSelectorBatch(np.asarray(allowed, dtype=np.int64))
+        vector = np.asarray([store._embed_query(query)], dtype=np.float32)
+        params = search_parameters(store.index, nprobe=self.nprobe, ef_search=self.ef_search, selector=selector)
+        _, positions = store.index.search(vector, limit, params=params)
+        return [int(position) for position in positions[0] if position != -1]
+
+    def _documents(self, positions):
+        store = self.vectorstore
+        documents = []
+        for position in positions:
+            document = store.docstore.search(store.index_to_docstore_id[position])
+            if isinstance(document, Document):
+                documents.append(document)
+        return documents
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        with stage_timer("retrieve"):
+            documents = self._retrieve(query)
+        return pack_context(documents, self.token_budget) if self.token_budget else documents
+
+    def _retrieve(self, query):
+        docstore = self.vectorstore.docstore
+        hybrid = self.hybrid and isinstance(docstore, SQLiteDocstore)
+        reranker = get_reranker() if self.rerank else None
+        if not hybrid and reranker is None:
+            return self._documents(self._dense_positions(query, self.k))
+
+        fetch_k = max(self.fetch_k, self.k)
+        positions = self._dense_positions(query, fetch_k)
+        if hybrid:
+            keyword = docstore.keyword_positions(query, fetch_k, filter=self.filter)
+            positions = reciprocal_rank_fusion([positions, keyword])
+        if reranker is None:
+            return self._documents(positions[:self.k])
+        candidates = self._documents(positions[:max(RERANK_CANDIDATES, self.k)])
+        return reranker.rerank(query, candidates, self.k)
+
+
+def make_retriever(vectorstore, k=RETRIEVAL_K, nprobe=None, ef_search=None, filter=None):
+    return FAISSSearchRetriever(vectorstore=vectorstore, k=k, nprobe=nprobe, ef_search=ef_search, filter=filter)
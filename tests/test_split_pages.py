@@ -0,0 +1,58 @@
+"""Table-preserving page chunking (``embeding.split_pages``).
+
+Page strings are built the way layout extraction joins a page's elements:
+text lines, and tables as ``|cell|`` rows followed by a blank line.
+"""
+
+from embeding import split_pages
+
+HEADER = "|Part|Interval|Notes|"
+
+
+def table(rows, header=HEADER):
+    return "\n".join([header] + [f"|P-{n}|{n * 100} h|check seal {n}|" for n in range(rows)]) + "\n"
+
+
+def page(*elements):
+    return "\n".join(elements)
+
+
+def chunks_of(text, **kwargs):
+    return [chunk for _, chunk in split_pages([text], **kwargs)]
+
+
+def table_chunks(chunks):
+    return [chunk for chunk in chunks if chunk.startswith("|")]
+
+
+def test_table_is_one_chunk():
+    text = page("Maintenance schedule for the pump assembly.", table(5), "Inspect every part after use.")
+    chunks = chunks_of(text, chunk_size=60, chunk_overlap=0)
+    assert table_chunks(chunks) == [table(5).strip()]
+    assert "Maintenance schedule for the pump assembly." in chunks
+    assert "Inspect every part after use." in chunks
+
+
+def test_oversized_table_splits_between_rows_with_header():
+    rows = table(40).strip().split("\n")
+    chunks = table_chunks(chunks_of(page("Schedule:", table(40)), table_chunk_size=300))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        lines = chunk.split("\n")
+        assert lines[0] == HEADER
+        assert len(lines) > 1
+        assert len(chunk) <= 300
+        assert all(line in rows[1:] for line in lines[1:])
+    # Every body row appears exactly once, in order
+    assert [line for chunk in chunks for line in chunk.split("\n")[1:]] == rows[1:]
+
+
+def test_adjacent_tables_are_not_merged():
+    other = table(3, header="|Tool|Size|Torque|")
+    chunks = table_chunks(chunks_of(page(table(3), other)))
+    assert chunks == [table(3).strip(), other.strip()]
+
+
+def test_chunks_keep_their_page_number():
+    pages = ["Intro text on the first page.", page("Second page.", table(2))]
+    assert [number for number, _ in split_pages(pages)] == [1, 2, 2]
@@ -0,0 +1,25 @@
+# tokens.py
+
+import math
+import os
+
+# Average characters per LLM token; llama-family tokenizers land around 3.5-4
+# for English and French prose. Only used for budgeting, never for billing.
+CHARS_PER_TOKEN = float(os.environ.get("RAG_CHARS_PER_TOKEN", "3.5"))
+
+
+def estimate_tokens(text):
+    """Cheap upper-leaning estimate of the number of tokens in ``text``."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut ``text`` to roughly ``max_tokens`` tokens, preferring a word boundary."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    return cut[:space] if space > max_chars // 2 else cut
@@ -0,0 +1,174 @@
+# uploads.py
+"""Content-addressed storage of uploaded PDFs.
+
+Uploads are streamed in chunks into ``<upload dir>/blobs/<aa>/<sha256>.pdf``
+while being hashed, so a file is written once however many times, and
+under however many names, it is uploaded. A small SQLite manifest records
+which blob was submitted to which collection and by which ingestion job;
+``/upload`` uses it to skip files that are already indexed or queued
+before any extraction happens. ``/ask`` files are not kept: each request
+hashes its own temporary copy, which it removes when done.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from concurrency import upload_stage
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.environ.get("RAG_UPLOAD_DIR", "uploads")
+# Largest accepted upload; bigger requests get 413
+UPLOAD_MAX_BYTES = int(float(os.environ.get("RAG_UPLOAD_MAX_MB", "100")) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    digest TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    job_id TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (digest, collection)
+);
+"""
+
+
+def too_large(max_bytes=UPLOAD_MAX_BYTES):
+    return HTTPException(status_code=413, detail=f"Upload exceeds the limit of {max_bytes} bytes")
+
+
+class UploadStore:
+    """Blobs keyed by their sha256 digest plus a manifest of submitted uploads."""
+
+    def __init__(self, root=UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES, stage=upload_stage):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stage = stage
+        self.blob_dir = os.path.join(root, "blobs")
+        self.duplicates = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        """The manifest connection, creating the store on first use (callers hold ``_lock``)."""
+        if self._conn is None:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.root, "manifest.sqlite"), check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def open(self):
+        """Create the blob directory and manifest now rather than on the first upload."""
+        with self._lock:
+            self._db()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.pdf")
+
+    async def save(self, file, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Stream ``file`` into the store; return ``(digest, path, created)``.
+
+        ``created`` is False when an identical blob was already stored, in
+        which case the copy just received is dropped. Raises 413 as soon as
+        more than ``max_bytes`` have been read, and 429 when the upload
+        stage is full. The stage slot is held only while the body is being
+        copied; disk writes run on a worker thread.
+        """
+        digest, tmp_path = await self._receive_file(file, chunk_size)
+        try:
+            return digest, *await asyncio.to_thread(self._commit, digest, tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @asynccontextmanager
+    async def received(self, file, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Receive ``file`` into a private temporary file for the block; yield ``(digest, path)``.
+
+        For uploads that are not kept (``/ask``): the copy is never shared
+        with other requests, so removing it afterwards cannot pull a blob
+        out from under a concurrent upload of the same content.
+        """
+        digest, tmp_path = await self._receive_file(file, chunk_size)
+        try:
+            yield digest, tmp_path
+        finally:
+            await asyncio.to_thread(os.unlink, tmp_path)
+
+    async def _receive_file(self, file, chunk_size):
+        """Copy ``file`` to a temporary file in the store, holding an upload slot; return ``(digest, path)``."""
+        async with self.stage.slot():
+            await asyncio.to_thread(self.open)
+            fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=self.blob_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as buffer:
+                    digest = await self._receive(file, buffer, chunk_size)
+                return digest, tmp_path
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+
+    async def _receive(self, file, buffer, chunk_size):
+        """Copy ``file`` into ``buffer`` while hashing it; return the hex digest."""
+        digest = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise too_large(self.max_bytes)
+            digest.update(chunk)
+            await asyncio.to_thread(buffer.write, chunk)
+        return digest.hexdigest()
+
+    def _commit(self, digest, tmp_path):
+        """Move a received upload to its blob path; return ``(path, created)``."""
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path, True
+
+    def lookup(self, digest, collection):
+        """The manifest entry for ``digest`` in ``collection``, or None."""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT filename, size, job_id, created FROM uploads WHERE digest = ? AND collection = ?",
+                (digest, collection)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("filename", "size", "job_id", "created"), row))
+
+    def record(self, digest, collection, filename, job_id):
+        size = os.path.getsize(self.blob_path(digest))
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO uploads (digest, collection, filename, size, job_id, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, collection, filename, size, job_id, time.time())
+            )
+
+    def stats(self):
+        with self._lock:
+            count, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads").fetchone()
+        return {"uploads": count, "bytes": total, "duplicates_skipped": self.duplicates,
+                "max_bytes": self.max_bytes}